@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+# Accuracy of the float32 and int32 sketches against the float64 ones: the
+# same privatized reports are aggregated with every sketch type and the
+# estimated frequencies are compared.
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from clip_protocol.utils.sketch import SKETCH_DTYPES, is_raw, debias_estimate
+from clip_protocol.main.agregate import build_user_sketch
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.hadamard_count_mean.private_hcms_client import privateHCMSClient
+
+def synthetic_dataset(N, domain_size, seed=0):
+    """Builds a dataset of N events with Zipf distributed frequencies."""
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, domain_size + 1)
+    values = rng.choice([f"AOI {i:03d}" for i in range(domain_size)], size=N, p=weights / weights.sum())
+    return pd.DataFrame({"user": "user", "value": values})
+
+def privatize(df, k, m, e, privacy_method):
+    """Privatizes the dataset once and returns the reports with the hash functions."""
+    if privacy_method == "PCMeS":
+        client = privateCMSClient(e, k, m, df)
+        return client.execute_client(), client.H
+    client = privateHCMSClient(e, k, m, df)
+    reports = pd.DataFrame(client.execute_client(), columns=["0", "1", "2", "3"])
+    return reports, client.hashes
+
+def estimate_domain(M, N, hashes, domain, k, m, e, privacy_method):
+    total = M[np.arange(k)[:, None], hashes.hash_all(domain)].sum(axis=0, dtype=np.float64)
+    return debias_estimate(total, N, k, m, e, privacy_method, is_raw(M.dtype))
+
+def run_accuracy_check(df, k, m, e, privacy_method):
+    reports, hashes = privatize(df, k, m, e, privacy_method)
+    domain = df["value"].unique().tolist()
+    N = len(df)
+
+    estimates = {}
+    rows = []
+    for dtype in SKETCH_DTYPES:
+        M = build_user_sketch(reports, k, m, e, privacy_method, dtype)
+        estimates[dtype] = estimate_domain(M, N, hashes, domain, k, m, e, privacy_method)
+        diff = np.abs(estimates[dtype] - estimates["float64"])
+        rows.append([dtype, f"{M.nbytes / 2**20:.2f}", f"{diff.max():.2e}", f"{diff.max() / N:.2e}"])
+
+    print(f"📐 {privacy_method} k={k} m={m} ε={e} N={N} |domain|={len(domain)}")
+    print(tabulate(rows, headers=["Sketch type", "Size (MB)", "Max |Δ estimate|", "Max |Δ| / N"], tablefmt="fancy_grid"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the estimates of the float32 and int32 sketches with the float64 ones")
+    parser.add_argument("-d", type=str, required=False, help="Path to an input excel file, a synthetic dataset is used by default")
+    parser.add_argument("-k", type=int, default=64, help="Number of hash functions")
+    parser.add_argument("-m", type=int, default=1024, help="Size of the sketch, a power of 2 for PHCMS")
+    parser.add_argument("-e", type=float, default=2.0, help="Privacy parameter")
+    parser.add_argument("-n", type=int, default=100000, help="Number of events of the synthetic dataset")
+    args = parser.parse_args()
+
+    if args.d:
+        df = pd.read_excel(args.d)
+        df.columns = ["user", "value"]
+    else:
+        df = synthetic_dataset(args.n, 200)
+    for privacy_method in ("PCMeS", "PHCMS"):
+        run_accuracy_check(df, args.k, args.m, args.e, privacy_method)
@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import subprocess
+import time
+from tabulate import tabulate
+
+# Startup time of the console scripts: the time a fresh interpreter takes to
+# import what a command needs before it can start working, compared to a budget.
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+# Entry point and pipeline module imported by every command, and its budget in milliseconds
+COMMANDS = {
+    "setup": ("cli_setup", "clip_protocol.main.setup", 2500),
+    "mask": ("cli_mask", "clip_protocol.main.mask", 1500),
+    "aggregate": ("cli_agregate", "clip_protocol.main.agregate", 1500),
+    "estimate": ("cli_estimate", "clip_protocol.main.estimate", 300),
+    "clip_merge": ("cli_merge", "clip_protocol.main.merge", 300),
+    "clip_clear": ("clear", None, 150),
+}
+
+def time_command(entry_point, module, repetitions):
+    """
+    Measures the startup time of a command in fresh interpreters.
+
+    Args:
+        entry_point (str): Function of clip_protocol.cli run by the command.
+        module (str): Pipeline module the command imports, None if it imports none.
+        repetitions (int): Number of interpreters started.
+
+    Returns:
+        float: Best time in milliseconds over the repetitions, without the bare interpreter startup.
+    """
+    code = f"from clip_protocol.cli import {entry_point}"
+    if module:
+        code += f"; import {module}"
+    return best_time(code, repetitions) - best_time("pass", repetitions)
+
+def best_time(code, repetitions):
+    env = {**os.environ, "PYTHONPATH": SRC_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def run_startup_time(commands, repetitions):
+    rows, over_budget = [], []
+    for command in commands:
+        entry_point, module, budget = COMMANDS[command]
+        elapsed = time_command(entry_point, module, repetitions)
+        status = "✅" if elapsed <= budget else "❌"
+        if elapsed > budget:
+            over_budget.append(command)
+        rows.append([command, f"{elapsed:.0f}", budget, status])
+
+    print(tabulate(rows, headers=["Command", "Startup (ms)", "Budget (ms)", ""], tablefmt="fancy_grid"))
+    if over_budget:
+        print(f"❌ Over budget: {', '.join(over_budget)}")
+    return not over_budget
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the startup time of the console scripts against their budget")
+    parser.add_argument("-c", type=str, nargs="+", choices=list(COMMANDS), default=list(COMMANDS), help="Commands to measure")
+    parser.add_argument("-r", type=int, default=5, help="Interpreters started per command, the best time is kept")
+    args = parser.parse_args()
+    sys.exit(0 if run_startup_time(args.c, args.r) else 1)
@@ -1,77 +1,133 @@
 import argparse
 import os
-import pandas as pd
 import sys
 import shutil
-from appdirs import user_data_dir
-import pickle
 
-from clip_protocol.main.setup import run_setup
-from clip_protocol.main.mask import run_mask
-from clip_protocol.main.agregate import run_agregate
-from clip_protocol.main.estimate import run_estimate
+# The pipeline modules and their heavy dependencies (pandas, numba, optuna,
+# scipy) are imported inside every command, once its arguments are parsed,
+# so each command only pays for what it uses.
+
+def read_excel(path):
+    """Reads the input dataset, skipping the title row of the spreadsheets that have one."""
+    import pandas as pd
+    df_temp = pd.read_excel(path)
+
+    if any(col.startswith("Unnamed") for col in df_temp.columns):
+        return pd.read_excel(path, header=1)
+    return df_temp
 
 def cli_setup():
     parser = argparse.ArgumentParser(description="Run privatization mask with input CSV")
     parser.add_argument("-d", type=str, required=True, help="Path to the input excel file")
+    parser.add_argument("-s", type=str, choices=["sketch", "reports"], default="sketch",
+                        help="Sample the private sketch of every trial directly (sketch) or privatize every record (reports)")
+    parser.add_argument("-w", type=int, default=1, help="Number of processes that run the trials in parallel")
     args = parser.parse_args()
     if not os.path.isfile(args.d):
         print(f"❌ File not found: {args.d}")
         sys.exit(1)
 
-    df_temp = pd.read_excel(args.d)
-
-    if any(col.startswith("Unnamed") for col in df_temp.columns):
-        df = pd.read_excel(args.d, header=1)  
-    else:
-        df = df_temp
-
-    run_setup(df)
+    from clip_protocol.main.setup import run_setup
+    run_setup(read_excel(args.d), args.s, args.w)
 
 def cli_mask():
     parser = argparse.ArgumentParser(description="Run privatization mask with input CSV")
     parser.add_argument("-d", type=str, required=True, help="Path to the input CSV file")
-    parser.add_argument("-o", type=str, required=False, help="Path to save the privatized output CSV")
+    parser.add_argument("-o", type=str, required=False, help="Path to save a copy of the privatized report file")
+    parser.add_argument("-s", type=str, choices=["sketch", "reports"], default="reports",
+                        help="Sample the private sketch of every trial directly (sketch) or privatize every record (reports)")
+    parser.add_argument("-b", action="store_true", help="Search epsilon by bisection instead of an Optuna study")
+    parser.add_argument("-r", type=int, default=3, help="Privatizations averaged in every bisection probe")
+    parser.add_argument("-w", type=int, default=1, help="Number of processes that run the trials in parallel")
+    parser.add_argument("-a", action="store_true",
+                        help="Append the reports to the saved privatized dataset, with its epsilon and hash functions")
     args = parser.parse_args()
 
     if not os.path.isfile(args.d):
         print(f"❌ File not found: {args.d}")
         sys.exit(1)
 
-    df_temp = pd.read_excel(args.d)
-
-    if any(col.startswith("Unnamed") for col in df_temp.columns):
-        df = pd.read_excel(args.d, header=1)  
-    else:
-        df = df_temp
-        
-    df_data = run_mask(df)
+    from clip_protocol.main.mask import run_mask
+    from clip_protocol.utils.utils import PRIVATIZED_DATASET
+    try:
+        df_data = run_mask(read_excel(args.d), args.s, "bisection" if args.b else "optuna", args.r, args.w, args.a)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
 
-    if args.o:
+    if args.o and df_data is not None:
         output_dir = os.path.dirname(args.o)
-        if not os.path.exists(output_dir):
+        if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        df_data.to_csv(args.o, index=False)
+        shutil.copyfile(PRIVATIZED_DATASET, args.o)
         print(f"✅ Privatized dataset saved to {args.o}")
 
 def cli_agregate():
-    run_agregate()
+    parser = argparse.ArgumentParser(description="Aggregate the privatized data into one sketch per user")
+    parser.add_argument("-w", type=int, default=1, help="Number of worker processes used to build the sketches")
+    parser.add_argument("-c", type=int, required=False, help="Stream the privatized dataset in chunks of this number of reports")
+    parser.add_argument("-t", type=str, choices=["float64", "float32", "int32"], default="float64",
+                        help="Type of the user sketches, int32 keeps the raw sums of the reports")
+    args = parser.parse_args()
+    if args.w < 1:
+        print(f"❌ The number of workers must be at least 1, got {args.w}")
+        sys.exit(1)
+    if args.c is not None and args.c < 1:
+        print(f"❌ The chunk size must be at least 1, got {args.c}")
+        sys.exit(1)
+    from clip_protocol.main.agregate import run_agregate
+    run_agregate(workers=args.w, chunk_size=args.c, dtype=args.t)
 
 def cli_estimate():
     parser = argparse.ArgumentParser(description="Run estimation")
-    parser.add_argument("-d", type=str, required=False, help="Path to the input pickle file")
+    parser.add_argument("-d", type=str, required=False, help="Path to the saved sketches (.npy) or to a legacy pickle file")
     args = parser.parse_args()
+    from clip_protocol.main.estimate import run_estimate
     df = None
     if args.d:
         if not os.path.isfile(args.d):
             print(f"❌ File not found: {args.d}")
             sys.exit(1)
-        with open(args.d, "rb") as f:
-            df = pickle.load(f)
+        if args.d.endswith(".npy"):
+            from clip_protocol.utils.utils import load_sketch_store
+            df = load_sketch_store(args.d[:-len(".npy")])
+        else:
+            import pickle
+            with open(args.d, "rb") as f:
+                df = pickle.load(f)
     run_estimate(df)
 
+def cli_merge():
+    parser = argparse.ArgumentParser(description="Merge sketch stores aggregated on different machines")
+    parser.add_argument("-i", type=str, nargs="+", required=True, help="Paths to the sketch stores (.npy) to merge")
+    parser.add_argument("-o", type=str, required=True, help="Path to save the merged sketch store")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.i:
+        if not os.path.isfile(path):
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+        paths.append(path[:-len(".npy")] if path.endswith(".npy") else path)
+    output = args.o[:-len(".npy")] if args.o.endswith(".npy") else args.o
+
+    from clip_protocol.main.merge import run_merge
+    try:
+        run_merge(paths, output)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+def cli_warmup():
+    parser = argparse.ArgumentParser(description="Compile the numba kernels into the on-disk cache")
+    parser.add_argument("-t", type=float, default=0.2, help="Seconds spent measuring the steady-state throughput of every kernel")
+    args = parser.parse_args()
+    from clip_protocol.main.warmup import run_warmup
+    run_warmup(args.t)
+
 def clear():
+    from appdirs import user_data_dir
     DATA_DIR = user_data_dir("clip_protocol")
 
     if not os.path.exists(DATA_DIR):
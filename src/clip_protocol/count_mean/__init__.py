@@ -9,10 +9,12 @@ Modules:
 - cms_client_mean.py: Implements the client-side logic for generating private count means.
 - private_cms_client.py: Contains the client-side logic for perturbing data before sending it to the server.
 - private_cms_server.py: Implements the server-side logic for aggregating and analyzing perturbed data.
+- report_batch.py: Stores the perturbed reports with their ±1 vectors bit-packed.
 
 Main Functions:
 - execute_client: Simulates the client side of the privatized Count-Min Sketch for all elements in the dataset.
 - server_simulator: Simulates the server side of the privatized Count-Min Sketch, processes the privatized data, and estimates frequencies.
 - update_sketch_matrix: Updates the sketch matrix based on the privatized data received from the client.
 - estimate_client: Estimates the frequency of an element based on the private CMS sketch matrix.
+- estimate_many: Estimates the frequency of every element of a domain at once, as a DataFrame.
 """
\ No newline at end of file
@@ -1,9 +1,8 @@
 import random
 import numpy as np
-from sympy import primerange
 from rich.progress import Progress
 
-from clip_protocol.utils.utils import generate_hash_functions, display_results
+from clip_protocol.utils.utils import generate_hash_functions, display_results, random_prime
 
 class CMSClient:
     """
@@ -30,9 +29,11 @@ class CMSClient:
             Simulates the server side of the CMS, processes the data, and estimates frequencies.
     """
 
-    def __init__(self, k, m, df):
+    def __init__(self, k, m, df, dtype="float64"):
         """
         Initializes the CMSClient with the given parameters.
+
+        The sketch only holds counts, so an integer dtype keeps them exact.
         """
         self.df = df
         self.k = k 
@@ -42,12 +43,11 @@ class CMSClient:
         self.N = len(self.dataset)
         
         # Creation of the sketch matrix
-        self.M = np.zeros((self.k, self.m))
+        self.M = np.zeros((self.k, self.m), dtype=dtype)
 
         # Definition of the hash family 3 by 3
-        primes = list(primerange(10**6, 10**7))
-        p = primes[random.randint(0, len(primes)-1)]
-        self.H = generate_hash_functions(self.k,p, 3,self.m)
+        p = random_prime(10**6, 10**7)
+        self.H, _ = generate_hash_functions(self.k,p, 3,self.m)
 
     def client(self, d):
         """
@@ -72,10 +72,7 @@ class CMSClient:
         Args:
             d (element): The element to be used for updating the sketch matrix.
         """
-        for i in range (self.k):
-            selected_hash = self.H[i]
-            hash_index = selected_hash(d)
-            self.M[i ,hash_index] += 1
+        self.M[np.arange(self.k), self.H.hash_element(d)] += 1
 
     def estimate_client(self,d):
         """
@@ -87,10 +84,7 @@ class CMSClient:
         Returns:
             float: The estimated frequency of the element.
         """
-        mean = 0
-        for i in range(self.k):
-            selected_hash = self.H[i]
-            mean += self.M[i,selected_hash(d)]
+        mean = np.sum(self.M[np.arange(self.k), self.H.hash_element(d)])
         return mean/self.k
     
     def server_simulator(self):
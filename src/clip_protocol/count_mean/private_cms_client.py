@@ -1,99 +1,188 @@
-import random
 import numpy as np
-from sympy import primerange
 import pandas as pd
 from rich.progress import Progress
-from numba import njit
-from concurrent.futures import ThreadPoolExecutor
 
-from clip_protocol.utils.utils import generate_hash_functions
+from clip_protocol.utils.utils import generate_hash_functions, rebuild_hash_functions, random_prime, event_codes
+from clip_protocol.count_mean.report_batch import ReportBatch, sum_packed_reports
+from clip_protocol.utils.jit import njit
+from clip_protocol.utils.sketch import SketchAccumulator, is_raw, debias_estimate
 
 @njit
-def bernoulli_vector(epsilon, m):
-    b = np.random.binomial(1, (np.exp(epsilon/2)) / ((np.exp(epsilon/2)) + 1), m)
-    return 2 * b - 1
+def update_sketch_matrix(S, counts, v, j):
+    """Adds a ±1 vector to the row j of the integer sums S and counts it."""
+    counts[j] += 1
+    for i in range(S.shape[1]):
+        S[j, i] += v[i]
 
 @njit
-def update_sketch_matrix(M, v, j, epsilon, k, m):
-    c_e = (np.exp(epsilon/2)+1) / ((np.exp(epsilon/2))-1)
-    x = k * ((c_e/2) * v + (1/2) * np.ones_like(v))
-    for i in range (m):
-        M[j,i] += x[i]
+def sum_reports(S, counts, V, J):
+    """Adds every row of V to the row J[r] of S and counts the reports per row."""
+    n, m = V.shape
+    for r in range(n):
+        j = J[r]
+        counts[j] += 1
+        for i in range(m):
+            S[j, i] += V[r, i]
+
+def aggregate_reports(sketch, reports, batch_size=1024, callback=None):
+    """
+    Adds a collection of (v, j, ...) PCMeS reports to an accumulator.
+
+    The update is linear, so the reports are reduced per hash index j in
+    chunks into integer sums; the c_e scaling is left to materialize.
+    A ReportBatch is reduced straight from its bit-packed buffer.
+
+    Args:
+        sketch (SketchAccumulator): PCMeS accumulator, updated in place.
+        reports (ReportBatch or list): Reports whose first two fields are the ±1 vector and j.
+        batch_size (int): Number of reports reduced at once.
+        callback (callable, optional): Called with the number of reports of each processed chunk.
+
+    Returns:
+        SketchAccumulator: The updated accumulator.
+    """
+    S, counts = sketch.S, sketch.counts
+    for start in range(0, len(reports), batch_size):
+        stop = min(start + batch_size, len(reports))
+        if isinstance(reports, ReportBatch):
+            sum_packed_reports(S, counts, reports.bits[start:stop], reports.j[start:stop])
+        else:
+            chunk = reports[start:stop]
+            V = np.stack([r[0] for r in chunk])
+            J = np.array([r[1] for r in chunk], dtype=np.int64)
+            sum_reports(S, counts, V, J)
+        if callback is not None:
+            callback(stop - start)
+    return sketch
 
 class privateCMSClient:
-    def __init__(self, epsilon, k, m, df):
+    def __init__(self, epsilon, k, m, df, dtype="float64", hash_params=None):
         self.df = df
         self.epsilon = epsilon
         self.k = k
         self.m = m
-        self.dataset = self.df['value'].tolist()
-        self.domain = self.df['value'].unique().tolist()
-        self.N = len(self.dataset)
+        # Events as integer codes into the domain
+        self.codes, self.domain = event_codes(self.df['value'])
+        self.N = len(self.codes)
 
-        # Creation of the sketch matrix
-        self.M = np.zeros((self.k, self.m))
+        # Creation of the sketch matrix, scaled from the exact sums of the reports
+        self.sketch = SketchAccumulator(self.k, self.m, "PCMeS")
+        self.M = np.zeros((self.k, self.m), dtype=dtype)
 
-        # List to store the privatized matrices
+        # Batch with the privatized reports
         self.client_matrix = []
 
-        # Definition of the hash family 3 by 3
-        primes = list(primerange(10**6, 10**7))
-        p = primes[random.randint(0, len(primes)-1)]
-        self.H, self.coefs = generate_hash_functions(self.k, p, 3, self.m)
+        # Probability of keeping each entry of the one-hot vector
+        self.p_keep = np.exp(self.epsilon/2) / (np.exp(self.epsilon/2) + 1)
+        # Every draw of the client comes from this generator, so replacing it with a seeded one reproduces a run
+        self.rng = np.random.default_rng()
 
-    def client(self, d):
-        j = random.randint(0, self.k-1)
-        v = np.full(self.m, -1)
-        selected_hash = self.H[j]
-        v[selected_hash(d)] = 1
-        b = bernoulli_vector(self.epsilon, self.m)
-        v_aux = v * b
-        return v_aux, j
+        # Definition of the hash family 3 by 3, or reuse of the family of earlier reports
+        if hash_params is None:
+            p = random_prime(10**6, 10**7)
+            self.H, self.coefs = generate_hash_functions(self.k, p, 3, self.m)
+        else:
+            self.H, self.coefs = rebuild_hash_functions(hash_params), hash_params
+        # Hash values of every event of the domain, computed once
+        self.hash_table = self.H.hash_all(self.domain)
 
     def estimate_client(self,d):
-        sum_aux = 0
-        for i in range(self.k):
-            selected_hash = self.H[i]
-            sum_aux += self.M[i, selected_hash(d)]
-        f_estimated = (self.m/(self.m-1))*((sum_aux/self.k)-(self.N/self.m))
-        return f_estimated
-    
-    def execute_client(self):
-        privatized_data = []
-
-        data_with_users = list(zip(self.df['value'].tolist(), self.df['user'].tolist()))
-        
-        def process(d_u):
-            d, user = d_u
-            v_aux, j = self.client(d)
-            return (v_aux, j, user)
-        
+        sum_aux = np.sum(self.M[np.arange(self.k), self.H.hash_element(d)], dtype=np.float64)
+        return debias_estimate(sum_aux, self.N, self.k, self.m, self.epsilon, "PCMeS", is_raw(self.M.dtype))
+
+    def estimate_many(self, domain, columns=None):
+        """
+        Estimates the frequency of every element of a domain at once.
+
+        The (k, |domain|) matrix of hashed columns is computed once and the
+        cells of all the elements are gathered with a single fancy index.
+
+        Args:
+            domain (list): Elements whose frequency is estimated.
+            columns (numpy.ndarray, optional): Hash values of the domain, computed when not given.
+
+        Returns:
+            pandas.DataFrame: The "Element" and "Frequency" of every element.
+        """
+        if columns is None:
+            columns = self.H.hash_all(domain)
+        total = self.M[np.arange(self.k)[:, None], columns].sum(axis=0, dtype=np.float64)
+        frequency = debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PCMeS", is_raw(self.M.dtype))
+        return pd.DataFrame({"Element": list(domain), "Frequency": frequency})
+
+    def client_batch(self, hash_indices):
+        """
+        Privatizes a chunk of records at once.
+
+        Args:
+            hash_indices (numpy.ndarray): (k, n) matrix with the k hash values of every record.
+
+        Returns:
+            tuple: The (n, m) matrix of privatized vectors and the n chosen hash indices.
+        """
+        n = hash_indices.shape[1]
+        rows = np.arange(n)
+        j = self.rng.integers(0, self.k, size=n)
+        v = np.full((n, self.m), -1, dtype=np.int8)
+        v[rows, hash_indices[j, rows]] = 1
+        keep = self.rng.random((n, self.m), dtype=np.float32) < self.p_keep
+        np.negative(v, out=v, where=~keep)
+        return v, j
+
+    def execute_client(self, batch_size=256):
+        # The vectors are packed as they are generated, one bit per entry
+        privatized_data = ReportBatch.empty(self.N, self.m)
+        privatized_data.users[:] = self.df['user'].to_numpy()
+
         with Progress() as progress:
-            bar = progress.add_task("Processing client data", total=len(data_with_users))
-            with ThreadPoolExecutor() as executor:
-                for result in executor.map(process, data_with_users):
-                    privatized_data.append(result)
-                    progress.update(bar, advance=1)
+            bar = progress.add_task("Processing client data", total=self.N)
+            for start in range(0, self.N, batch_size):
+                stop = min(start + batch_size, self.N)
+                v, j = self.client_batch(self.hash_table[:, self.codes[start:stop]])
+                privatized_data.set(start, v, j)
+                progress.update(bar, advance=stop - start)
         self.client_matrix = privatized_data
         return privatized_data
     
     def server_simulator(self,privatized_data):
         with Progress() as progress:
             bar = progress.add_task('Update sketch matrix', total=len(privatized_data))
-            
-            for v, j, _ in privatized_data:
-                update_sketch_matrix(self.M, v, j, self.epsilon, self.k, self.m)
-                progress.update(bar, advance=1)
+            aggregate_reports(self.sketch, privatized_data, callback=lambda n: progress.update(bar, advance=n))
+            self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
 
-            bar = progress.add_task('Estimate frequencies', total=len(self.domain))
-            F_estimated = {}
-            for x in self.domain:
-                F_estimated[x] = self.estimate_client(x)
-                progress.update(bar, advance=1)
+        return self.estimate_many(self.domain, self.hash_table), self.coefs
 
-        return F_estimated, self.coefs
+    def simulate_server(self):
+        """
+        Draws the sketch the server would build, without generating the reports.
 
-def run_private_cms_client(k, m, e, df):
+        Records of the same element that choose the same row j add up to
+        independent Bernoulli flips, so the records per row are drawn from a
+        multinomial and the number of +1 entries of every cell from two
+        binomials. The sketch has the same distribution as running
+        execute_client and server_simulator, at a cost of O(|domain|·k + k·m).
+
+        Returns:
+            tuple: The estimated frequency DataFrame of the domain and the hash coefficients.
+        """
+        counts = np.bincount(self.codes, minlength=len(self.domain))
+
+        # Number of records of every element that choose every row
+        a = self.rng.multinomial(counts, np.full(self.k, 1 / self.k))
+        n_j = a.sum(axis=0)
+
+        # Number of records of every row whose one-hot entry falls in every column
+        A = np.zeros((self.k, self.m), dtype=np.int64)
+        np.add.at(A, (np.arange(self.k)[:, None], self.hash_table), a.T)
+
+        # +1 entries after the flips: kept one-hot entries plus flipped -1 entries
+        plus = self.rng.binomial(A, self.p_keep) + self.rng.binomial(n_j[:, None] - A, 1 - self.p_keep)
+        self.sketch.add_row_sums(2 * plus - n_j[:, None], n_j)
+        self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
+
+        return self.estimate_many(self.domain, self.hash_table), self.coefs
+
+def run_private_cms_client(k, m, e, df, simulate=False, dtype="float64", hash_params=None):
     """
     Runs the privatized Count-Min Sketch algorithm and displays the results.
 
@@ -102,19 +191,27 @@ def run_private_cms_client(k, m, e, df):
         m (int): Size of the sketch matrix.
         e (float): Privacy parameter.
         df (DataFrame): Dataset to be processed.
+        simulate (bool): Sample the sketch directly instead of privatizing every record.
+            No privatized data is returned then.
+        dtype (str): Type of the sketch matrix, one of SKETCH_DTYPES.
+        hash_params (dict, optional): Parameters of an existing hash family, as returned by
+            HashFamily.params(). A new family is drawn when not given.
 
     Returns:
         tuple: A tuple containing the hash functions, the results table, the error table, the privatized data, and the estimated frequency DataFrame.
     """
     # Initialize the private Count-Mean Sketch
-    PCMS = privateCMSClient(e, k, m, df)
-
-    # Client side: process the private data
-    privatized_data = PCMS.execute_client()
-
-    # Simulate the server side
-    f_estimated, coefs = PCMS.server_simulator(privatized_data)
-
-    df_estimated = pd.DataFrame(list(f_estimated.items()), columns=['Element', 'Frequency'])
+    PCMS = privateCMSClient(e, k, m, df, dtype, hash_params)
+
+    if simulate:
+        # Only the estimates are needed, so the sketch is sampled without the reports
+        privatized_data = None
+        df_estimated, coefs = PCMS.simulate_server()
+    else:
+        # Client side: process the private data
+        privatized_data = PCMS.execute_client()
+
+        # Simulate the server side
+        df_estimated, coefs = PCMS.server_simulator(privatized_data)
 
     return coefs, privatized_data, df_estimated
\ No newline at end of file
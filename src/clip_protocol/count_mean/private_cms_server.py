@@ -1,11 +1,12 @@
 
 import numpy as np
 import pandas as pd
-import os
 from colorama import Fore, Style
 from rich.progress import Progress
 
-from clip_protocol.utils.utils import display_results
+from clip_protocol.utils.utils import event_codes
+from clip_protocol.count_mean.private_cms_client import aggregate_reports, update_sketch_matrix as update_cms_matrix
+from clip_protocol.utils.sketch import Sketch, SketchAccumulator, is_raw, debias_estimate, incompatible_parameters
 
 class privateCMSServer:
     """
@@ -17,13 +18,15 @@ class privateCMSServer:
         epsilon (float): The privacy parameter epsilon.
         k (int): The number of hash functions.
         m (int): The size of the sketch.
-        dataset (list): The list of values in the dataset.
         domain (list): The unique values in the dataset.
+        domain_index (dict): Position of every element of the domain.
         N (int): The size of the dataset.
         H (list): The list of hash functions.
-        M (numpy.ndarray): The sketch matrix.
+        sketch (SketchAccumulator): Exact integer sums of the reports.
+        M (numpy.ndarray): The sketch matrix, holding the raw sums of the reports if it is integer.
+        stale (bool): Whether reports were added to the sums after M was last scaled.
     """
-    def __init__(self, epsilon, k, m, df, H):
+    def __init__(self, epsilon, k, m, df, H, dtype="float64"):
         """
         Initializes the privateCMSServer class with the given parameters.
 
@@ -33,31 +36,46 @@ class privateCMSServer:
             m (int): The size of the sketch.
             df (pandas.DataFrame): The dataset containing the values.
             H (list): The list of hash functions.
+            dtype (str): Type of the sketch matrix, one of SKETCH_DTYPES.
         """
         self.df = df
         self.epsilon = epsilon
         self.k = k
         self.m = m
-        self.dataset = self.df['value'].tolist()
-        self.domain = self.df['value'].unique().tolist()
-        self.N = len(self.dataset)
+        self.domain = event_codes(self.df['value'])[1]
+        # Position of every element of the domain, for constant time lookups
+        self.domain_index = {x: i for i, x in enumerate(self.domain)}
+        self.N = len(self.df)
         self.H = H
 
-        # Creation of the sketch matrix
-        self.M = np.zeros((self.k, self.m))
+        # Creation of the sketch matrix, scaled from the exact sums of the reports
+        self.sketch = SketchAccumulator(self.k, self.m, "PCMeS")
+        self.M = np.zeros((self.k, self.m), dtype=dtype)
+        self.stale = False
     
     def update_sketch_matrix(self,v,j):
         """
-        Updates the sketch matrix based on the given privatized data.
+        Adds the given privatized data to the sums of the sketch.
+
+        Only integers are added; the sketch matrix is scaled from the sums
+        when the server is next queried.
 
         Args:
             v (numpy.ndarray): The privatized vector.
             j (int): The index of the hash function used.
         """
-        c_e = (np.exp(self.epsilon/2)+1) / ((np.exp(self.epsilon/2))-1)
-        x = self.k * ((c_e/2) * v + (1/2) * np.ones_like(v))
-        for i in range (self.m):
-            self.M[j,i] += x[i]
+        update_cms_matrix(self.sketch.S, self.sketch.counts, np.asarray(v, dtype=np.int8), j)
+        self.stale = True
+
+    def materialize(self):
+        """Scales the sums of the reports into the sketch matrix."""
+        self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
+        self.stale = False
+
+    def refresh(self):
+        """Scales the sums into the sketch matrix if reports were added since it was last scaled."""
+        if self.stale:
+            self.materialize()
 
     def execute_server(self,privatized_data):
         """
@@ -65,25 +83,18 @@ class privateCMSServer:
         and estimating the frequencies.
 
         Args:
-            privatized_data (list): The privatized data from the client.
+            privatized_data (ReportBatch or list): The privatized data from the client.
 
         Returns:
-            dict: A dictionary containing the estimated frequencies for each element.
+            pandas.DataFrame: The estimated frequency of every element of the domain.
         """
         with Progress() as progress:
             task = progress.add_task('[cyan]Update sketch matrix', total=len(privatized_data))
 
-            for data in privatized_data:
-                self.update_sketch_matrix(data[0],data[1])
-                progress.update(task, advance=1)
+            aggregate_reports(self.sketch, privatized_data, callback=lambda n: progress.update(task, advance=n))
+            self.materialize()
 
-            F_estimated = {}
-            task = progress.add_task('[cyan]Obtaining histogram of estimated frequencies', total=len(self.domain))
-            for x in self.domain:
-                F_estimated[x] = self.estimate_server(x)
-                progress.update(task, advance=1)
-                
-        return F_estimated
+        return self.estimate_many(self.domain)
 
     def estimate_server(self,d):
         """
@@ -95,14 +106,66 @@ class privateCMSServer:
         Returns:
             float: The estimated frequency of the element.
         """
-        sum_aux = 0
-        for i in range(self.k):
-            selected_hash = self.H[i]
-            sum_aux += self.M[i, selected_hash(d)]
-        
-        f_estimated = (self.m/(self.m-1))*((sum_aux/self.k)-(self.N/self.m))
-        return f_estimated
-    
+        self.refresh()
+        sum_aux = np.sum(self.M[np.arange(self.k), self.H.hash_element(d)], dtype=np.float64)
+        return debias_estimate(sum_aux, self.N, self.k, self.m, self.epsilon, "PCMeS", is_raw(self.M.dtype))
+
+    def estimate_many(self, domain):
+        """
+        Estimates the frequency of every element of a domain at once.
+
+        The (k, |domain|) matrix of hashed columns is computed once and the
+        cells of all the elements are gathered with a single fancy index.
+
+        Args:
+            domain (list): Elements whose frequency is estimated.
+
+        Returns:
+            pandas.DataFrame: The "Element" and "Frequency" of every element.
+        """
+        self.refresh()
+        columns = self.H.hash_all(domain)
+        total = self.M[np.arange(self.k)[:, None], columns].sum(axis=0, dtype=np.float64)
+        frequency = debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PCMeS", is_raw(self.M.dtype))
+        return pd.DataFrame({"Element": list(domain), "Frequency": frequency})
+
+    def to_sketch(self):
+        """
+        Returns the current sketch matrix as a mergeable Sketch.
+
+        Returns:
+            Sketch: Sketch holding the reports added to this server.
+        """
+        self.refresh()
+        return Sketch(self.M, self.N, self.k, self.m, self.epsilon, "PCMeS", self.H.params())
+
+    def parameters(self):
+        """Returns the parameters two servers must share to be merged, as in Sketch.parameters."""
+        return {"k": self.k, "m": self.m, "e": self.epsilon, "privacy_method": "PCMeS",
+                "hash": self.H.params(), "dtype": self.M.dtype.name}
+
+    def merge(self, other):
+        """
+        Adds the sketch of another server built with the same parameters.
+
+        Args:
+            other (privateCMSServer): Server that processed a disjoint set of reports.
+
+        Raises:
+            ValueError: If k, m, epsilon, the hash coefficients or the kind of sketch differ.
+        """
+        mismatches = incompatible_parameters(self.parameters(), other.parameters())
+        if mismatches:
+            raise ValueError(f"Servers cannot be merged, different {', '.join(mismatches)}")
+        # The sums are merged exactly and scaled again
+        self.sketch = self.sketch + other.sketch
+        self.materialize()
+        self.N += other.N
+        for x in other.domain:
+            if x not in self.domain_index:
+                self.domain_index[x] = len(self.domain)
+                self.domain.append(x)
+
     def query_server(self, query_element):
         """
         Queries the server for the estimated frequency of an element.
@@ -113,7 +176,7 @@ class privateCMSServer:
         Returns:
             float or str: The estimated frequency of the element, or a message if the element is not in the domain.
         """
-        if query_element not in self.domain:
+        if query_element not in self.domain_index:
             return "Element not in the domain"
         estimation = self.estimate_server(query_element)
         return estimation
@@ -129,13 +192,13 @@ def run_private_cms_server(k, m, e, df, H, privatized_data):
         e (float): The privacy parameter epsilon.
         df (pandas.DataFrame): The dataset containing the values.
         H (list): The list of hash functions.
-        privatized_data (list): The privatized data from the client.
+        privatized_data (ReportBatch or list): The privatized data from the client.
+
+    Returns:
+        ReportBatch or list: The privatized data, kept packed so it can be saved to the report file.
     """
     #Initialize the server Count-Mean Sketch
     server = privateCMSServer(e, k, m, df, H)
-
-    # Save the privatized data
-    privatized_data_save = pd.DataFrame(privatized_data)
     
     # Execute the server
     f_estimated = server.execute_server(privatized_data)
@@ -148,7 +211,7 @@ def run_private_cms_server(k, m, e, df, H, privatized_data):
         estimation = server.query_server(query)
         print(f"The estimated frequency of {query} is {estimation:.2f}")
     
-    return privatized_data_save
+    return privatized_data
 
 def run_private_cms_server_multiuser(k, m, private):
     """
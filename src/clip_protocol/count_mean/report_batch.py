@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from clip_protocol.utils.jit import njit
+
+
+@njit
+def sum_packed_reports(S, counts, bits, J):
+    """Adds every bit-packed ±1 row of bits to the row J[r] of S and counts the reports per row."""
+    n = bits.shape[0]
+    m = S.shape[1]
+    for r in range(n):
+        j = J[r]
+        counts[j] += 1
+        for i in range(m):
+            bit = (bits[r, i >> 3] >> (7 - (i & 7))) & 1
+            S[j, i] += 2 * bit - 1
+
+class ReportBatch:
+    """
+    Collection of PCMeS reports with the ±1 vectors bit-packed.
+
+    Every vector takes ceil(m/8) bytes of one contiguous uint8 buffer, a set
+    bit meaning +1, while the hash indices and the users are kept in parallel
+    arrays. Iterating the batch yields (v, j, user) tuples like the list of
+    reports returned by the client used to.
+
+    Attributes:
+        bits (numpy.ndarray): (n, ceil(m/8)) uint8 matrix with the packed vectors.
+        j (numpy.ndarray): Hash index chosen by every report.
+        users (numpy.ndarray): User of every report.
+        m (int): Length of the vectors.
+    """
+    def __init__(self, bits, j, users, m):
+        self.bits = bits
+        self.j = j
+        self.users = users
+        self.m = m
+
+    @classmethod
+    def empty(cls, n, m):
+        """Allocates a batch of n reports to be filled with set()."""
+        return cls(np.zeros((n, (m + 7) // 8), dtype=np.uint8), np.zeros(n, dtype=np.int64),
+                   np.empty(n, dtype=object), m)
+
+    @classmethod
+    def from_vectors(cls, V, j, users):
+        """
+        Packs a matrix of ±1 vectors.
+
+        Args:
+            V (numpy.ndarray): (n, m) matrix of ±1 vectors.
+            j (array-like): Hash index of every vector.
+            users (array-like): User of every vector.
+        """
+        return cls(np.packbits(V > 0, axis=1), np.asarray(j, dtype=np.int64),
+                   np.asarray(users, dtype=object), V.shape[1])
+
+    def set(self, start, V, j, users=None):
+        """Packs a chunk of ±1 vectors into the reports starting at start."""
+        stop = start + len(V)
+        self.bits[start:stop] = np.packbits(V > 0, axis=1)
+        self.j[start:stop] = j
+        if users is not None:
+            self.users[start:stop] = users
+
+    def vectors(self, start=0, stop=None):
+        """Unpacks the reports in [start, stop) into an int8 matrix of ±1 vectors."""
+        bits = np.unpackbits(self.bits[start:stop], axis=1, count=self.m)
+        return bits.view(np.int8) * 2 - 1
+
+    def take(self, rows):
+        """Returns a new batch with the reports at the given positions."""
+        return ReportBatch(self.bits[rows], self.j[rows], self.users[rows], self.m)
+
+    def user_rows(self):
+        """Returns a dictionary with the positions of the reports of every user, in order of appearance."""
+        return pd.Series(self.users).groupby(self.users, sort=False).indices
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes + self.j.nbytes
+
+    def __len__(self):
+        return len(self.j)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(i)
+        # Negative positions count from the end, as in a list of reports
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("report index out of range")
+        return self.vectors(i, i + 1)[0], int(self.j[i]), self.users[i]
+
+    def __iter__(self, batch_size=1024):
+        for start in range(0, len(self), batch_size):
+            V = self.vectors(start, start + batch_size)
+            for i, v in enumerate(V):
+                yield v, int(self.j[start + i]), self.users[start + i]
@@ -14,4 +14,5 @@ Main Functions:
 - server_simulator: Simulates the server side of the privatized Count-Min Sketch, processes the privatized data, and estimates frequencies.
 - update_sketch_matrix: Updates the sketch matrix based on the privatized data received from the client.
 - estimate_client: Estimates the frequency of an element based on the private CMS sketch matrix.
+- estimate_many: Estimates the frequency of every element of a domain at once, as a DataFrame.
 """
\ No newline at end of file
@@ -1,12 +1,10 @@
-from sympy import primerange
-import random
 import numpy as np
 from rich.progress import Progress
 import pandas as pd
-from numba import njit
-from concurrent.futures import ThreadPoolExecutor
 
-from clip_protocol.utils.utils import generate_hash_functions
+from clip_protocol.utils.utils import generate_hash_functions, rebuild_hash_functions, random_prime, event_codes
+from clip_protocol.utils.jit import njit, prange
+from clip_protocol.utils.sketch import SketchAccumulator, is_raw, debias_estimate
 
 def hadamard_matrix(n):
     if n == 1:
@@ -15,94 +13,188 @@ def hadamard_matrix(n):
         h_half = hadamard_matrix(n // 2)
         return np.block([[h_half, h_half], [h_half, -h_half]])
 
+def hadamard_entry(l, h):
+    """
+    Returns the entry H[l, h] of the Sylvester Hadamard matrix without building it.
+
+    The entry is -1 when l & h has an odd number of set bits and 1 otherwise.
+    Works both with integers and with numpy integer arrays.
+    """
+    x = l & h
+    for shift in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> shift)
+    return 1 - 2 * (x & 1)
+
 @njit
-def update_sketch_matrix(epsilon, k, M, w, j, l):
-    c_e = (np.exp(epsilon/2)+1) / ((np.exp(epsilon/2))-1)
-    x = k * c_e * w
-    M[j,l] =  M[j,l] + x
+def update_sketch_matrix(S, counts, w, j, l):
+    """Adds the ±1 bit w of a report to the cell (j, l) of the integer sums S and counts it."""
+    S[j, l] += w
+    counts[j] += 1
 
+@njit(parallel=True)
+def fwht_rows(M):
+    """
+    In-place fast Walsh-Hadamard transform of every row of M.
 
-def traspose_M(M, H):
-    return M @ np.transpose(H)
+    Computes M @ H.T for the Sylvester Hadamard matrix H in O(k·m·log m)
+    without allocating H. The rows are transformed in parallel.
+    """
+    k, m = M.shape
+    for r in prange(k):
+        h = 1
+        while h < m:
+            for i in range(0, m, 2 * h):
+                for t in range(i, i + h):
+                    a = M[r, t]
+                    b = M[r, t + h]
+                    M[r, t] = a + b
+                    M[r, t + h] = a - b
+            h *= 2
+    return M
+
+def traspose_M(M):
+    """
+    Applies the Hadamard transform to the sketch matrix.
+
+    Args:
+        M (numpy.ndarray): (k, m) sketch matrix, m must be a power of 2.
+
+    Returns:
+        numpy.ndarray: The transformed sketch matrix, with the type of M.
+    """
+    m = M.shape[1]
+    if m & (m - 1) != 0:
+        raise ValueError(f"m must be a power of 2 to apply the Hadamard transform, got m={m}")
+    # Integer sketches stay exact, every transformed cell is bounded by the reports of its row
+    return fwht_rows(np.array(M))
 
 class privateHCMSClient:
-    def __init__(self, epsilon, k, m, df):
+    def __init__(self, epsilon, k, m, df, dtype="float64", hash_params=None):
         self.df = df
         self.epsilon = epsilon
         self.k = k
         self.m = m
-        self.dataset = self.df['value'].tolist()
-        self.domain = self.df['value'].unique().tolist()
-        self.H = hadamard_matrix(self.m)
-        self.N = len(self.dataset)
+        # Events as integer codes into the domain
+        self.codes, self.domain = event_codes(self.df['value'])
+        self.N = len(self.codes)
 
-        # Creation of the sketch matrix
-        self.M = np.zeros((self.k, self.m))
+        # Creation of the sketch matrix, transformed and scaled from the exact sums of the reports
+        self.sketch = SketchAccumulator(self.k, self.m, "PHCMS")
+        self.M = np.zeros((self.k, self.m), dtype=dtype)
 
         # List to store the privatized matrices
         self.client_matrix = []
 
-        # Definition of the hash family 3 by 3
-        primes = list(primerange(10**6, 10**7))
-        p = primes[random.randint(0, len(primes)-1)]
-        self.hashes, self.coeffs = generate_hash_functions(self.k, p, 3, self.m)
-
-    def client(self,d):
-        j = random.randint(0, self.k - 1)
-        v = np.full(self.m, 0)
-        selected_hash = self.hashes[j]
-        v[selected_hash(d)] = 1
-        w = np.dot(self.H, v)
-        l = random.randint(0, self.m-1)
-
-        P_active = np.exp(self.epsilon) / (np.exp(self.epsilon) + 1)
-        if random.random() <= P_active:
-            b = 1
+        # Probability of keeping the sign of the Hadamard coefficient
+        self.p_active = np.exp(self.epsilon) / (np.exp(self.epsilon) + 1)
+        # Every draw of the client comes from this generator, so replacing it with a seeded one reproduces a run
+        self.rng = np.random.default_rng()
+
+        # Definition of the hash family 3 by 3, or reuse of the family of earlier reports
+        if hash_params is None:
+            p = random_prime(10**6, 10**7)
+            self.hashes, self.coeffs = generate_hash_functions(self.k, p, 3, self.m)
         else:
-            b = -1
-        return b * w[l],j,l
+            self.hashes, self.coeffs = rebuild_hash_functions(hash_params), hash_params
+        # Hash values of every event of the domain, computed once
+        self.hash_table = self.hashes.hash_all(self.domain)
+
+    def client_batch(self, hash_indices):
+        """
+        Privatizes a chunk of records at once.
+
+        Args:
+            hash_indices (numpy.ndarray): (k, n) matrix with the k hash values of every record.
+
+        Returns:
+            tuple: The privatized coefficients, the chosen hash indices and the chosen coefficient indices.
+        """
+        n = hash_indices.shape[1]
+        j = self.rng.integers(0, self.k, size=n)
+        l = self.rng.integers(0, self.m, size=n)
+        b = np.where(self.rng.random(n) <= self.p_active, 1, -1)
+        w = b * hadamard_entry(l, hash_indices[j, np.arange(n)])
+        return w, j, l
 
     def estimate_client(self, d):
-        return (self.m / (self.m-1)) * (1/self.k * np.sum([self.M[i,self.hashes[i](d)] for i in range(self.k)]) - self.N/self.m)
-    
-    def execute_client(self):
+        total = np.sum(self.M[np.arange(self.k), self.hashes.hash_element(d)], dtype=np.float64)
+        return debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PHCMS", is_raw(self.M.dtype))
+
+    def estimate_many(self, domain, columns=None):
+        """
+        Estimates the frequency of every element of a domain at once.
+
+        The (k, |domain|) matrix of hashed columns is computed once and the
+        cells of all the elements are gathered with a single fancy index.
+
+        Args:
+            domain (list): Elements whose frequency is estimated.
+            columns (numpy.ndarray, optional): Hash values of the domain, computed when not given.
+
+        Returns:
+            pandas.DataFrame: The "Element" and "Frequency" of every element.
+        """
+        if columns is None:
+            columns = self.hashes.hash_all(domain)
+        total = self.M[np.arange(self.k)[:, None], columns].sum(axis=0, dtype=np.float64)
+        frequency = debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PHCMS", is_raw(self.M.dtype))
+        return pd.DataFrame({"Element": list(domain), "Frequency": frequency})
+
+    def execute_client(self, batch_size=4096):
         privatized_data = []
 
-        data_with_users = list(zip(self.df['value'].tolist(), self.df['user'].tolist()))
+        users = self.df['user'].tolist()
 
-        def process(d_u):
-            d, user = d_u
-            w, j, l = self.client(d)
-            return (w, j, l, user)
-        
         with Progress() as progress:
-            task = progress.add_task('Processing client data', total=len(data_with_users))
-            with ThreadPoolExecutor() as executor:
-                for result in executor.map(process, data_with_users):
-                    privatized_data.append(result)
-                    progress.update(task, advance=1)
+            task = progress.add_task('Processing client data', total=self.N)
+            for start in range(0, self.N, batch_size):
+                stop = min(start + batch_size, self.N)
+                w, j, l = self.client_batch(self.hash_table[:, self.codes[start:stop]])
+                privatized_data.extend(zip(w.tolist(), j.tolist(), l.tolist(), users[start:stop]))
+                progress.update(task, advance=stop - start)
         self.client_matrix = privatized_data
         return privatized_data
 
-    def server_simulator(self, privatized_data):
+    def server_simulator(self, privatized_data, batch_size=4096):
         with Progress() as progress:
             task = progress.add_task('[cyan]Update sketch matrix', total=len(privatized_data))
-            for v, j, w, _ in privatized_data:
-                update_sketch_matrix(self.epsilon, self.k, self.M, v, j, w)
-                progress.update(task, advance=1)
+            for start in range(0, len(privatized_data), batch_size):
+                chunk = privatized_data[start:start + batch_size]
+                w = np.array([r[0] for r in chunk], dtype=np.float64)
+                j = np.array([r[1] for r in chunk], dtype=np.int64)
+                l = np.array([r[2] for r in chunk], dtype=np.int64)
+                self.sketch.add_hadamard_reports(w, j, l)
+                progress.update(task, advance=len(chunk))
 
             # Transpose the matrix
-            self.M = traspose_M(self.M, self.H)
-
-            # Estimate the frequencies
-            F_estimated = {}
-            task = progress.add_task('[cyan]Obtaining histogram of estimated frequencies', total=len(self.domain))
-            for x in self.domain:
-                F_estimated[x] = self.estimate_client(x)
-                progress.update(task, advance=1)
-        return F_estimated, self.coeffs
-    
-def run_private_hcms_client(k, m, e, df):
+            self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
+
+        # Estimate the frequencies
+        return self.estimate_many(self.domain, self.hash_table), self.coeffs
+
+    def simulate_server(self):
+        """
+        Draws the sketch the server would build, without generating the reports.
+
+        Every record only touches one cell of the sketch, so the choices of all
+        the records are drawn at once and added with a single bincount instead
+        of building the list of reports. The sketch has the same distribution
+        as running execute_client and server_simulator.
+
+        Returns:
+            tuple: The estimated frequency DataFrame of the domain and the hash coefficients.
+        """
+        j = self.rng.integers(0, self.k, size=self.N)
+        l = self.rng.integers(0, self.m, size=self.N)
+        b = np.where(self.rng.random(self.N) <= self.p_active, 1, -1)
+        w = b * hadamard_entry(l, self.hash_table[j, self.codes])
+
+        self.sketch.add_hadamard_reports(w, j, l)
+        self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
+
+        return self.estimate_many(self.domain, self.hash_table), self.coeffs
+
+def run_private_hcms_client(k, m, e, df, simulate=False, dtype="float64", hash_params=None):
     """
     Runs the private Count-Min Sketch client, processes the data, and estimates frequencies on the server.
 
@@ -111,19 +203,28 @@ def run_private_hcms_client(k, m, e, df):
         m (int): The size of the sketch matrix.
         e (float): The privacy parameter epsilon for differential privacy.
         df (pandas.DataFrame): The dataset in DataFrame format.
+        simulate (bool): Sample the sketch directly instead of privatizing every record.
+            No privatized data is returned then.
+        dtype (str): Type of the sketch matrix, one of SKETCH_DTYPES.
+        hash_params (dict, optional): Parameters of an existing hash family, as returned by
+            HashFamily.params(). A new family is drawn when not given.
 
     Returns:
         tuple: A tuple containing the hash functions, data table, error table, privatized data, and the estimated frequencies.
     """
     # Initialize the client 
-    client = privateHCMSClient(e, k, m, df)
+    client = privateHCMSClient(e, k, m, df, dtype, hash_params)
 
-    # Client side: process the private data
-    privatized_data = client.execute_client()
+    if simulate:
+        # Only the estimates are needed, so the sketch is sampled without the reports
+        privatized_data = None
+        df_estimated, coeffs = client.simulate_server()
+    else:
+        # Client side: process the private data
+        privatized_data = client.execute_client()
 
-    # Simulate the server side
-    f_estimated, coeffs = client.server_simulator(privatized_data)
-    df_estimated = pd.DataFrame(list(f_estimated.items()), columns=['Element', 'Frequency'])
+        # Simulate the server side
+        df_estimated, coeffs = client.server_simulator(privatized_data)
 
     return coeffs, privatized_data, df_estimated
 
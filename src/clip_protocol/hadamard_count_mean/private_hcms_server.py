@@ -1,15 +1,16 @@
-import os
 import numpy as np
 import pandas as pd
 from rich.progress import Progress
 
-from clip_protocol.utils.utils import display_results
+from clip_protocol.utils.utils import display_results, get_real_frequency, event_codes
+from clip_protocol.hadamard_count_mean.private_hcms_client import update_sketch_matrix as update_hcms_matrix
+from clip_protocol.utils.sketch import Sketch, SketchAccumulator, is_raw, debias_estimate, incompatible_parameters
 
 class privateHCMSServer:
     """
     A private Hadamard Count-Min Sketch (HCMS) server implementation.
     """
-    def __init__(self, epsilon, k, m, df, hashes):
+    def __init__(self, epsilon, k, m, df, hashes, dtype="float64"):
         """
         Initializes the private HCMS server.
         
@@ -18,54 +19,49 @@ class privateHCMSServer:
         :param m: Number of columns in the sketch matrix
         :param df: Dataframe containing the dataset
         :param hashes: List of hash functions
+        :param dtype: Type of the sketch matrix, integer sketches hold the raw sums of w
         """
+        self.df = df
         self.epsilon = epsilon
         self.k = k
         self.m = m
-        self.dataset = self.df['value'].tolist()
-        self.domain = self.df['value'].unique().tolist()
-        self.H = self.hadamard_matrix(self.m)
-        self.N = len(self.dataset)
+        self.domain = event_codes(self.df['value'])[1]
+        # Position of every element of the domain, for constant time lookups
+        self.domain_index = {x: i for i, x in enumerate(self.domain)}
+        self.N = len(self.df)
         self.hashes = hashes
 
-        # Creation of the sketch matrix
-        self.M = np.zeros((self.k, self.m))
+        # Creation of the sketch matrix, transformed and scaled from the exact sums of the reports
+        self.sketch = SketchAccumulator(self.k, self.m, "PHCMS")
+        self.M = np.zeros((self.k, self.m), dtype=dtype)
+        # Whether data points were added to the sums after M was last transformed
+        self.stale = False
     
-    def hadamard_matrix(self,n):
-        """
-        Generates the Hadamard matrix recursively.
-
-        Args:
-            n (int): The size of the matrix.
-
-        Returns:
-            numpy.ndarray: The generated Hadamard matrix.
-        """
-        if n == 1:
-            return np.array([[1]])
-        else:
-            # Recursive function to generate the Hadamard matrix
-            h_half = self.hadamard_matrix(n // 2)
-            h = np.block([[h_half, h_half], [h_half, -h_half]])
-        return h
-
     def update_sketch_matrix(self, w, j, l):
         """
-        Updates the sketch matrix with a new data point.
+        Adds a new data point to the sums of the sketch, in the Hadamard domain.
+        The sums are transformed into the sketch matrix when the server is next queried.
         
         :param w: Weight of the data point
         :param j: Hash function index
         :param l: Hash value
         """
-        c_e = (np.exp(self.epsilon/2)+1) / ((np.exp(self.epsilon/2))-1)
-        x = self.k * c_e * w
-        self.M[j,l] =  self.M[j,l] + x
+        update_hcms_matrix(self.sketch.S, self.sketch.counts, int(w), j, l)
+        self.stale = True
 
     def traspose_M(self):
         """
-        Applies the Hadamard transformation to the sketch matrix.
+        Applies the Hadamard transformation to the sums and scales them into the sketch matrix.
+        """
+        self.M = self.sketch.materialize(self.epsilon, self.M.dtype)
+        self.stale = False
+
+    def refresh(self):
+        """
+        Transforms the sums into the sketch matrix if data points were added since it was last transformed.
         """
-        self.M = self.M @ np.transpose(self.H)
+        if self.stale:
+            self.traspose_M()
 
     def estimate_server(self,d):
         """
@@ -74,31 +70,91 @@ class privateHCMSServer:
         :param d: Element to estimate
         :return: Estimated frequency
         """
-        return (self.m / (self.m-1)) * (1/self.k * np.sum([self.M[i,self.hashes[i](d)] for i in range(self.k)]) - self.N/self.m)
+        self.refresh()
+        total = np.sum(self.M[np.arange(self.k), self.hashes.hash_element(d)], dtype=np.float64)
+        return debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PHCMS", is_raw(self.M.dtype))
+
+    def estimate_many(self, domain):
+        """
+        Estimates the frequency of every element of a domain at once.
+
+        The (k, |domain|) matrix of hashed columns is computed once and the
+        cells of all the elements are gathered with a single fancy index.
+
+        :param domain: Elements to estimate
+        :return: DataFrame with the "Element" and "Frequency" of every element
+        """
+        self.refresh()
+        columns = self.hashes.hash_all(domain)
+        total = self.M[np.arange(self.k)[:, None], columns].sum(axis=0, dtype=np.float64)
+        frequency = debias_estimate(total, self.N, self.k, self.m, self.epsilon, "PHCMS", is_raw(self.M.dtype))
+        return pd.DataFrame({"Element": list(domain), "Frequency": frequency})
 
-    def execute_server(self, privatized_data):
+    def execute_server(self, privatized_data, batch_size=4096):
         """
         Processes the privatized data and estimates frequencies.
+        The data points are added to the sums in chunks, as arrays.
         
-        :param privatized_data: List of privatized data points
-        :return: Dictionary of estimated frequencies
+        :param privatized_data: List of privatized (w, j, l, user) data points, or a DataFrame
+            with the "0", "1" and "2" columns as read from the report file
+        :param batch_size: Number of data points added at once
+        :return: DataFrame with the estimated frequency of every element of the domain
         """
         with Progress() as progress:
             task = progress.add_task('[cyan]Update sketch matrix', total=len(privatized_data))
-            for data in privatized_data:
-                self.update_sketch_matrix(data[0],data[1],data[2])
-                progress.update(task, advance=1)
+            for start in range(0, len(privatized_data), batch_size):
+                chunk = privatized_data[start:start + batch_size]
+                if isinstance(chunk, pd.DataFrame):
+                    w, j, l = chunk["0"].to_numpy(dtype=np.float64), chunk["1"].to_numpy(dtype=np.int64), chunk["2"].to_numpy(dtype=np.int64)
+                else:
+                    w = np.array([r[0] for r in chunk], dtype=np.float64)
+                    j = np.array([r[1] for r in chunk], dtype=np.int64)
+                    l = np.array([r[2] for r in chunk], dtype=np.int64)
+                self.sketch.add_hadamard_reports(w, j, l)
+                progress.update(task, advance=len(chunk))
 
             # Transpose the matrix
             self.traspose_M()
 
-            # Estimate the frequencies
-            F_estimated = {}
-            task = progress.add_task('[cyan]Obtaining histogram of estimated frequencies', total=len(self.domain))
-            for x in self.domain:
-                F_estimated[x] = self.estimate_server(x)
-                progress.update(task, advance=1)
-        return F_estimated
+        # Estimate the frequencies
+        return self.estimate_many(self.domain)
+
+    def to_sketch(self):
+        """
+        Returns the current sketch matrix as a mergeable Sketch.
+
+        :return: Sketch holding the data points added to this server
+        """
+        self.refresh()
+        return Sketch(self.M, self.N, self.k, self.m, self.epsilon, "PHCMS", self.hashes.params())
+
+    def parameters(self):
+        """
+        Returns the parameters two servers must share to be merged, as in Sketch.parameters.
+
+        :return: Dictionary with k, m, e, the privacy method, the hash parameters and the dtype
+        """
+        return {"k": self.k, "m": self.m, "e": self.epsilon, "privacy_method": "PHCMS",
+                "hash": self.hashes.params(), "dtype": self.M.dtype.name}
+
+    def merge(self, other):
+        """
+        Adds the sketch of another server built with the same parameters.
+        The sums of both servers are merged exactly and transformed again.
+
+        :param other: Server that processed a disjoint set of data points
+        :raises ValueError: If k, m, epsilon, the hash coefficients or the kind of sketch differ
+        """
+        mismatches = incompatible_parameters(self.parameters(), other.parameters())
+        if mismatches:
+            raise ValueError(f"Servers cannot be merged, different {', '.join(mismatches)}")
+        self.sketch = self.sketch + other.sketch
+        self.traspose_M()
+        self.N += other.N
+        for x in other.domain:
+            if x not in self.domain_index:
+                self.domain_index[x] = len(self.domain)
+                self.domain.append(x)
 
     def query_server(self, query_element):
         """
@@ -107,7 +163,7 @@ class privateHCMSServer:
         :param query_element: Element to query
         :return: Estimated frequency or a message if the element is not in the domain
         """
-        if query_element not in self.domain:
+        if query_element not in self.domain_index:
             return "Element not in the domain"
         estimation = self.estimate_server(query_element)
         return estimation
@@ -122,18 +178,16 @@ def run_private_hcms_server(k, m, e, df, hashes, privatized_data):
     :param df: Dataframe containing the dataset
     :param hashes: List of hash functions
     :param privatized_data: List of privatized data points
+    :return: The privatized data points, as given
     """
     # Initialize the server
     server = privateHCMSServer(e, k, m, df, hashes)
-
-    # Save the privatized data
-    privatized_data_save = pd.DataFrame(privatized_data)
     
     # Execute the server
     f_estimated = server.execute_server(privatized_data)
 
     # Show the results
-    display_results(df, f_estimated)
+    display_results(get_real_frequency(df), f_estimated)
 
     # Query the server
     while True:
@@ -143,7 +197,7 @@ def run_private_hcms_server(k, m, e, df, hashes, privatized_data):
         estimation = server.query_server(query)
         print(f"The estimated frequency of {query} is {estimation:.2f}")
     
-    return privatized_data_save
+    return privatized_data
 
 
   
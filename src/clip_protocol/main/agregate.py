@@ -1,74 +1,204 @@
 import os
 import sys
 import numpy as np
+import multiprocessing
 from concurrent.futures import ProcessPoolExecutor
-import pickle
 from rich.progress import Progress
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from clip_protocol.utils.utils import load_mask_json, save_agregate_json
-
-
-def update_sketch_matrix(M, k, e, privacy_method, data_point):
-    """Updates the sketch matrix based on the privatized data."""
-    if privacy_method == "PCMeS":
-        v, j = data_point
-        v = np.array(v)
-        c_e = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
-        x = k * ((c_e / 2) * v + (1 / 2) * np.ones_like(v))
-        M[j, :] += x
-    elif privacy_method == "PHCMS":
-        w, j, l = data_point
-        c_e = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
-        x = k * c_e * w
-        M[j, l] += x
-    return M
+from clip_protocol.utils.utils import load_mask_json, save_agregate_json, read_privatized_dataset
+from clip_protocol.utils.utils import open_report_file, records_to_reports, PRIVATIZED_DATASET
+from clip_protocol.utils.utils import save_agregate_checkpoint, load_agregate_checkpoint, clear_agregate_checkpoint
+from clip_protocol.utils.sketch import Sketch, SketchAccumulator
+from clip_protocol.count_mean.report_batch import ReportBatch, sum_packed_reports
+
+
+def accumulate_user_reports(sketch, user_data):
+    """
+    Adds privatized reports of a single user to the integer sums of their sketch.
+
+    PHCMS sums are kept in the Hadamard domain; the transform is linear
+    and is applied when the sketch is materialized.
+
+    Args:
+        sketch (SketchAccumulator): Sums of the user, updated in place.
+        user_data (ReportBatch or pandas.DataFrame): Reports of the user, a ReportBatch for
+            PCMeS and a DataFrame with the (w, j, l, user) columns for PHCMS.
+
+    Returns:
+        SketchAccumulator: The updated sums.
+    """
+    if sketch.privacy_method == "PCMeS":
+        sum_packed_reports(sketch.S, sketch.counts, user_data.bits, user_data.j)
+    elif sketch.privacy_method == "PHCMS":
+        w = user_data["0"].to_numpy(dtype=np.float64)
+        j = user_data["1"].to_numpy(dtype=np.int64)
+        l = user_data["2"].to_numpy(dtype=np.int64)
+        sketch.add_hadamard_reports(w, j, l)
+    return sketch
+
+def accumulator_dtype(dtype):
+    """Returns the type of the sums of sketches of the given dtype, 32 bits when the sketches take 32 bits."""
+    return np.int32 if np.dtype(dtype).itemsize <= 4 else np.int64
+
+def build_user_sketch(user_data, k, m, e, privacy_method, dtype="float64"):
+    """
+    Builds the sketch matrix of a single user from their privatized reports.
+
+    Args:
+        user_data (ReportBatch or pandas.DataFrame): Reports of the user.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter used by the clients.
+        privacy_method (str): "PCMeS" or "PHCMS".
+        dtype (str): Type of the sketch matrix, one of SKETCH_DTYPES.
+
+    Returns:
+        numpy.ndarray: The (k, m) sketch matrix.
+    """
+    sketch = SketchAccumulator(k, m, privacy_method, accumulator_dtype(dtype))
+    accumulate_user_reports(sketch, user_data)
+    return sketch.materialize(e, dtype)
+
+# Read-only state of the aggregation worker processes, set once per worker
+_worker_dataset = None
+_worker_params = None
+
+def _init_worker(path, params):
+    global _worker_dataset, _worker_params
+    # Every worker maps the report file itself, so the pages of the reports are shared
+    # through the page cache instead of pickling a copy of the dataset per worker
+    header, records = open_report_file(path)
+    _worker_dataset = records_to_reports(records, header["privacy_method"], header["m"])
+    _worker_params = params
+
+def _build_worker_sketch(rows):
+    user_data = _worker_dataset.take(rows)
+    return build_user_sketch(user_data, *_worker_params), len(rows)
 
 class Agregate:
-    def __init__(self):
-        self.k, self.m, self.e, _, self.privacy_method, self.private_dataset = load_mask_json()
+    def __init__(self, stream=False, dtype="float64"):
+        # When streaming, the privatized dataset is read in chunks instead of loaded at once
+        self.k, self.m, self.e, self.hashes, self.privacy_method, self.private_dataset = load_mask_json(with_dataset=not stream)
         self.sketch_by_user = {}
+        # Type of the user sketches, integer sketches hold the raw sums of the reports
+        self.dtype = np.dtype(dtype).name
+
+        # PCMeS reports are stored as (v, j, user) and PHCMS reports as (w, j, l, user)
+        self.user_column = "2" if self.privacy_method == "PCMeS" else "3"
+
+    def user_rows(self, reports):
+        """Returns a dictionary with the positions of the reports of every user."""
+        if isinstance(reports, ReportBatch):
+            return reports.user_rows()
+        return reports.groupby(self.user_column, sort=False).indices
 
     def compute_data(self, user_data):
-        M = np.zeros((self.k, self.m)) # Sketch matrix empty
-        with Progress() as progress:
-            task = progress.add_task("[cyan]Updating sketch matrix", total=len(user_data))
-            for _, row in user_data.iterrows(): # Iterate over the rows of the user data
-                    if self.privacy_method == "PCMeS":
-                        v = np.array([int(x) for x in row["0"].split()])
-                        data = (v, int(row["1"]))
-                    elif self.privacy_method == "PHCMS":
-                        data = (row["0"], row["1"], row["2"])
-                    M = update_sketch_matrix(M, self.k, self.e, self.privacy_method, data)
-                    progress.update(task, advance=1)
-                
-                    if self.privacy_method == "PHCMS":
-                        M = M @ np.transpose(self.H)
-        user_id = user_data["2"].iloc[0]
-        return user_id, {"M": M.tolist(), "N": len(user_data)}
+        M = build_user_sketch(user_data, self.k, self.m, self.e, self.privacy_method, self.dtype)
+        if isinstance(user_data, ReportBatch):
+            user_id = user_data.users[0]
+        else:
+            user_id = user_data[self.user_column].iloc[0]
+        return user_id, {"M": M, "N": len(user_data)}
     
-    def agregate_per_user(self):
-        users = self.private_dataset["2"].unique() # List of all users
-        user_groups = [self.private_dataset[self.private_dataset["2"] == user] for user in users] # List of sketches for each user
+    def agregate_per_user(self, workers=1):
+        # A single groupby pass splits the dataset into the rows of every user
+        user_rows = self.user_rows(self.private_dataset)
         sketch_by_user = {}
 
-        for i in range(len(users)):
-            user_id, sketch = self.compute_data(user_groups[i])
-            sketch_by_user[user_id] = sketch
+        with Progress() as progress:
+            task = progress.add_task("[cyan]Updating sketch matrix", total=len(user_rows))
+            if workers > 1:
+                # Every worker opens the report file once, and only row indices travel per task
+                params = (self.k, self.m, self.e, self.privacy_method, self.dtype)
+                # Spawned workers do not inherit the numba thread pool nor the progress thread
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                         initargs=(PRIVATIZED_DATASET, params)) as executor:
+                    # map keeps the order of the users, so the merge is deterministic
+                    results = executor.map(_build_worker_sketch, user_rows.values())
+                    for user_id, (M, N) in zip(user_rows, results):
+                        sketch_by_user[user_id] = {"M": M, "N": N}
+                        progress.update(task, advance=1)
+            else:
+                for rows in user_rows.values():
+                    user_id, sketch = self.compute_data(self.private_dataset.take(rows))
+                    sketch_by_user[user_id] = sketch
+                    progress.update(task, advance=1)
     
         self.sketch_by_user = sketch_by_user
+
+    def agregate_stream(self, chunk_size=10000, checkpoint_every=10):
+        """
+        Builds the user sketches streaming the privatized dataset in chunks.
+
+        Peak memory is bounded by one chunk plus the user sketches, which
+        are kept as exact integer sums until the end. Every checkpoint_every
+        chunks the sums are saved, so an interrupted run resumes from the
+        last checkpoint.
+
+        Args:
+            chunk_size (int): Number of reports read at once.
+            checkpoint_every (int): Number of chunks between checkpoints.
+        """
+        metadata = {"k": self.k, "m": self.m, "e": self.e, "privacy_method": self.privacy_method,
+                    "hash": self.hashes.params(), "dtype": self.dtype}
+        sums_by_user, rows = load_agregate_checkpoint(metadata)
+        if rows:
+            print(f"↩️ Resuming the aggregation after {rows} reports")
+
+        with Progress() as progress:
+            task = progress.add_task("[cyan]Updating sketch matrix", total=None, completed=rows)
+            chunks = read_privatized_dataset(chunk_size, skip=rows)
+            for i, chunk in enumerate(chunks, start=1):
+                for user_id, user_rows in self.user_rows(chunk).items():
+                    if user_id not in sums_by_user:
+                        sums_by_user[user_id] = SketchAccumulator(self.k, self.m, self.privacy_method,
+                                                                  accumulator_dtype(self.dtype))
+                    accumulate_user_reports(sums_by_user[user_id], chunk.take(user_rows))
+                rows += len(chunk)
+                progress.update(task, advance=len(chunk))
+                if i % checkpoint_every == 0:
+                    save_agregate_checkpoint(sums_by_user, rows, metadata)
+
+        self.sketch_by_user = {
+            user_id: {"M": sums.materialize(self.e, self.dtype), "N": sums.N}
+            for user_id, sums in sums_by_user.items()
+        }
+        clear_agregate_checkpoint()
+
+    def sketches(self):
+        """Returns the sketch of every user as a mergeable Sketch."""
+        return {
+            user_id: Sketch(sketch["M"], sketch["N"], self.k, self.m, self.e, self.privacy_method, self.hashes.params())
+            for user_id, sketch in self.sketch_by_user.items()
+        }
+
+    def merge(self, other):
+        """
+        Adds the user sketches of another aggregation built with the same mask parameters.
+
+        Args:
+            other (Agregate): Aggregation of a disjoint set of reports.
+        """
+        merged = self.sketches()
+        for user_id, sketch in other.sketches().items():
+            merged[user_id] = merged[user_id] + sketch if user_id in merged else sketch
+        self.sketch_by_user = {user_id: {"M": sketch.M, "N": sketch.N} for user_id, sketch in merged.items()}
         
     
-def run_agregate():
-    agregate_instance = Agregate()
+def run_agregate(workers=1, chunk_size=None, dtype="float64"):
+    agregate_instance = Agregate(stream=chunk_size is not None, dtype=dtype)
     print("🧑‍🤝‍🧑 Aggregate per user")
-    agregate_instance.agregate_per_user()
+    if chunk_size is not None:
+        agregate_instance.agregate_stream(chunk_size=chunk_size)
+    else:
+        agregate_instance.agregate_per_user(workers=workers)
     save_agregate_json(agregate_instance)
     res = input("Do you want to save the private sketches? (y/n): ")
     if res.lower() == "y":
-        path = input("Enter the path to the folder to save the private sketches: ")
-        path = os.path.join(os.getcwd(), "sketches.pkl")
-        with open(path, "wb") as f:
-            pickle.dump(agregate_instance.sketch_by_user, f)
-        print("✅ Private sketches saved")
+        path = input("Enter the path to the folder to save the private sketches: ").strip() or os.getcwd()
+        os.makedirs(path, exist_ok=True)
+        save_agregate_json(agregate_instance, os.path.join(path, "sketches"))
+        print(f"✅ Private sketches saved in {path}")
 
@@ -3,25 +3,74 @@ import sys
 import numpy as np
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from clip_protocol.utils.utils import load_agregate_json, load_mask_json
+from clip_protocol.utils.utils import load_agregate_json, load_mask_json, rebuild_hash_functions
+from clip_protocol.utils.sketch import is_raw, debias_estimate
 
 class Estimation:
     def __init__(self, df=None):
-        self.sketch_by_user = df if df is not None else load_agregate_json()
-        self.k, self.m, self.epsilon, self.hashes, self.method, _ = load_mask_json()
+        if df is None:
+            df = load_agregate_json()
+        elif isinstance(df, dict):
+            # Sketches pickled by older versions as {user: {"M": ..., "N": ...}}
+            df = (list(df), np.array([np.asarray(data["M"]) for data in df.values()]),
+                  np.array([data["N"] for data in df.values()]), {})
+        self.users, self.sketches, self.N, metadata = df
+        if "hash" in metadata:
+            # Sketch stores carry the parameters of the mask run they were built with
+            self.k, self.m, self.epsilon = metadata["k"], metadata["m"], metadata["e"]
+            self.method = metadata["privacy_method"]
+            self.hashes = rebuild_hash_functions(metadata["hash"])
+        else:
+            # Legacy pickles only hold the sketches, the parameters come from the local mask run
+            self.k, self.m, self.epsilon, self.hashes, self.method, _ = load_mask_json(with_dataset=False)
+        # Integer sketches hold the raw sums of the reports and are scaled here
+        self.raw = is_raw(self.sketches.dtype)
     
     def estimate_element(self, d, M, N):
         """Estimates the frequency of an element in the dataset."""
-        return (self.m / (self.m - 1)) * (1 / self.k * np.sum([M[i, self.hashes[i](d)] for i in range(self.k)]) - N / self.m)
+        total = np.sum(M[np.arange(self.k), self.hashes.hash_element(d)], dtype=np.float64)
+        return debias_estimate(total, N, self.k, self.m, self.epsilon, self.method, self.raw)
     
+    def estimate_matrix(self, events, batch_size=64):
+        """
+        Estimates the frequency of several events for every user at once.
+
+        The k hashed columns of every event are computed once and gathered
+        from all the user sketches with a single fancy-indexing operation.
+
+        Args:
+            events (list): Events to estimate.
+            batch_size (int): Number of user sketches gathered at once.
+
+        Returns:
+            numpy.ndarray: (users, events) matrix with the estimated frequencies.
+        """
+        columns = self.hashes.hash_all(events)
+        rows = np.arange(self.k)[:, None]
+        estimates = np.empty((len(self.users), len(events)))
+        for start in range(0, len(self.users), batch_size):
+            stop = start + batch_size
+            # (users, k, events) cells read from the memory-mapped store
+            total = self.sketches[start:stop, rows, columns].sum(axis=1, dtype=np.float64)
+            estimates[start:stop] = debias_estimate(total, self.N[start:stop, None], self.k, self.m,
+                                                    self.epsilon, self.method, self.raw)
+        return estimates
+
+    def estimate_events(self, events, batch_size=64):
+        """
+        Estimates the frequency of several events for every user at once.
+
+        Returns:
+            pandas.DataFrame: Users x events matrix with the estimated frequencies.
+        """
+        # Imported here so that the interactive queries do not load pandas
+        import pandas as pd
+        return pd.DataFrame(self.estimate_matrix(events, batch_size), index=self.users, columns=events)
+
     def query_all_users_event(self, event):
         print(f"\n📊 Estimated frequency of '{event}' per user:\n")
-        for user_id, user_data in self.sketch_by_user.items():
-            M = np.array(user_data["M"])
-            N = user_data["N"]
-            est = self.estimate_element(event, M, N)
-            if est < 0:
-                est = 0
+        estimates = np.clip(self.estimate_matrix([event])[:, 0], 0, None)
+        for user_id, est in zip(self.users, estimates):
             print(f"🧑 User {user_id}: {est:.4f}")
 
 def run_estimate(df=None):
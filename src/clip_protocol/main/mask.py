@@ -7,18 +7,26 @@ from tabulate import tabulate
 import argparse
 import hashlib
 import time
+from contextlib import nullcontext
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from clip_protocol.utils.utils import load_setup_json, get_real_frequency, save_mask_json, display_results
-from clip_protocol.count_mean.private_cms_client import run_private_cms_client
-from clip_protocol.hadamard_count_mean.private_hcms_client import run_private_hcms_client
+from clip_protocol.utils.utils import load_setup_json, get_real_frequency, save_mask_json, display_results, encode_events, event_codes
+from clip_protocol.utils.utils import read_report_header, PRIVATIZED_DATASET
+from clip_protocol.utils.trials import TrialPool, TrialArtifacts, optimize_study, run_private_client
 
 class Mask:
-    def __init__(self, privacy_level, df):
+    def __init__(self, privacy_level, df, simulation="reports", search="optuna", repetitions=3, workers=1):
         self.k, self.m, self.e_ref, self.n_trials, self.events_names, self.privacy_method, self.error_metric, self.error_value, self.tolerance, self.p = load_setup_json()
         self.privacy_level = privacy_level
         self.df = df
-        self.matching_trial = None
+        # "sketch" samples the private sketch of every trial directly, "reports" privatizes every record
+        self.simulation = simulation
+        # "optuna" runs a TPE study over e, "bisection" brackets the error band and halves it
+        self.search = search
+        # Privatizations averaged in every probe of the bisection
+        self.repetitions = repetitions
+        # Processes that run the trials in parallel
+        self.workers = workers
         self.N = len(self.df)
 
     def filter_dataframe(self):
@@ -29,75 +37,186 @@ class Mask:
         self.df = self.df[matching_columns].copy()
         self.df.columns = ["user", "value"]
 
-        self.df['value'] = self.df['value'].astype(str).apply(lambda x: x.strip())
-        self.df = self.df[self.df['value'] != '-']
-        self.df = self.df[self.df['value'].str.contains(r'\w', na=False)]
+        # The events are kept as integer codes into the dictionary of distinct values
+        self.df = encode_events(self.df)
         self.N = len(self.df)
 
         # Filter by percentage >= 0.1%
-        real_freq = get_real_frequency(self.df)
-        real_freq_dict = dict(zip(real_freq["Element"], real_freq["Frequency"]))
-        real_percent = {k: (v * 100 /self.N) for k, v in real_freq_dict.items()}
-        valid_elements = [k for k, v in real_percent.items() if v >= 0.1]
-        self.df = self.df[self.df["value"].isin(valid_elements)]
-        
-        # Pseudonimize the user column
-        self.df['user'] = self.df['user'].apply(self.pseudonimize)
+        codes, elements = event_codes(self.df["value"])
+        counts = np.bincount(codes, minlength=len(elements))
+        self.df = self.df[counts[codes] * 100 / self.N >= 0.1].copy()
+        self.df["value"] = self.df["value"].cat.remove_unused_categories()
+
+        # Pseudonimize the user column, hashing every distinct user once
+        self.df['user'] = self.df['user'].astype("category").map(self.pseudonimize)
     
     def pseudonimize(self, user_name):
         return hashlib.sha256(user_name.encode()).hexdigest()[:10] 
     
-    def run_command(self, e):
-        if self.privacy_method == "PCMeS":
-            coeffs, privatized_data, df_estimated = run_private_cms_client(self.k, self.m, e, self.df)
-        elif self.privacy_method == "PHCMS":
-            coeffs, privatized_data, df_estimated = run_private_hcms_client(self.k, self.m, e, self.df)
-        
-        return coeffs, privatized_data, df_estimated
+    def run_command(self, e, simulate=False):
+        return run_private_client(self.df, self.privacy_method, self.k, self.m, e, simulate)
+
+    def trial_pool(self):
+        """Returns a pool of trial workers sharing the dataset, or a null context when running in this process."""
+        return TrialPool(self.df, self.workers) if self.workers > 1 else nullcontext()
+
+    def privatize_for_append(self):
+        """
+        Privatizes the dataset to be appended to the saved privatized dataset.
+
+        The new reports are aggregated together with the saved ones, so they
+        are privatized with the e and the hash functions in the header of the
+        report file instead of searching e again.
+
+        Returns:
+            tuple: The e, the privatized data and the hash coefficients.
+
+        Raises:
+            ValueError: If the report file was written with another privacy method, k or m.
+        """
+        header, _, _ = read_report_header(PRIVATIZED_DATASET)
+        mismatches = [key for key in ("privacy_method", "k", "m") if header[key] != getattr(self, key)]
+        if mismatches:
+            raise ValueError(f"Reports cannot be appended to {PRIVATIZED_DATASET}, different {', '.join(mismatches)}")
+        coeffs, privatized_data, _ = run_private_client(self.df, self.privacy_method, self.k, self.m, header["e"],
+                                                        hash_params=header["hash"])
+        return header["e"], privatized_data, coeffs
+
+    def evaluate_e(self, e, simulate=False):
+        """
+        Privatizes the dataset with e and measures the maximum percentage error.
+
+        Args:
+            e (float): Privacy parameter.
+            simulate (bool): Sample the sketch directly instead of privatizing every record.
+
+        Returns:
+            tuple: The maximum percentage error, the hash coefficients and the privatized data.
+        """
+        coeffs, privatized_data, df_estimated = self.run_command(e, simulate)
+        return self.max_error(df_estimated), coeffs, privatized_data
+
+    def max_error(self, df_estimated):
+        """Displays the estimated frequencies and returns the maximum percentage error."""
+        headers=[
+            "Element", "Real Frequency", "Real Percentage", 
+            "Estimated Frequency", "Estimated Percentage", "Estimation Difference", 
+            "Percentage Error"
+        ]
+
+        table = display_results(get_real_frequency(self.df), df_estimated)
+        print(tabulate(table, headers=headers, tablefmt="fancy_grid"))
+
+        return max([float(row[-1].strip('%')) for row in table])
 
     def optimize_e(self):
-        def objective(trial):
-            e = round(trial.suggest_float('e', 0.1, self.e_ref, step=0.1), 4)
-            coeffs, privatized_data, df_estimated = self.run_command(e)
+        with self.trial_pool() as pool:
+            if self.search == "bisection":
+                best_e, coeffs, privatized_data = self.bisect_e(pool)
+            else:
+                best_e, coeffs, privatized_data = self.study_e(pool)
 
-            headers=[
-                "Element", "Real Frequency", "Real Percentage", 
-                "Estimated Frequency", "Estimated Percentage", "Estimation Difference", 
-                "Percentage Error"
-            ]
+        if privatized_data is None:
+            # The trials only sampled the sketches, so the dataset is privatized once with the chosen e
+            coeffs, privatized_data, _ = self.run_command(best_e)
+                
+        return best_e, privatized_data, coeffs
+
+    def study_e(self, pool=None):
+        """
+        Searches e with an Optuna study, running the trials in the workers of pool if given.
+
+        Returns:
+            tuple: The chosen e, the hash coefficients and the privatized data.
+        """
+        def suggest(trial):
+            e = round(trial.suggest_float('e', 0.1, self.e_ref, step=0.1), 4)
+            return self.privacy_method, self.k, self.m, e, self.simulation == "sketch"
 
-            table = display_results(get_real_frequency(self.df), df_estimated)
-            print(tabulate(table, headers=headers, tablefmt="fancy_grid"))
+        # Only the privatized data of the trials that can still be chosen is kept
+        artifacts = TrialArtifacts()
 
-            max_error = max([float(row[-1].strip('%')) for row in table])
+        def record(trial, args, result):
+            e = args[3]
+            coeffs, privatized_data, df_estimated = result
+            max_error = self.max_error(df_estimated)
 
             trial.set_user_attr('e', e)
             trial.set_user_attr('hash', coeffs)
-            trial.set_user_attr('privatized_data', privatized_data)
 
             bounds = self._get_error_bounds()
-            if bounds[0] < max_error <= bounds[1]:
-                self.matching_trial = trial
-                trial.study.stop()
+            stop = bounds[0] < max_error <= bounds[1]
             
             if max_error > bounds[1]:
-                return float("inf")
-            
-            return round(abs(bounds[1] - max_error), 4)
+                value = float("inf")
+            else:
+                value = round(abs(bounds[1] - max_error), 4)
+            artifacts.record(trial, value, {'privatized_data': privatized_data}, matching=stop)
+            return value, stop
 
         study = optuna.create_study(direction='minimize') 
-        study.optimize(objective, n_trials=self.n_trials)
+        optimize_study(study, self.n_trials, suggest, record, run_private_client, self.df, pool)
 
-        if self.matching_trial is not None:
-            trial = self.matching_trial
-        else:
-            trial = study.best_trial
+        trial = artifacts.chosen(study)
                
-        best_e = trial.user_attrs['e']
-        coeffs = trial.user_attrs['hash']
-        privatized_data = trial.user_attrs['privatized_data']
-                
-        return best_e, privatized_data, coeffs
+        return trial.user_attrs['e'], trial.user_attrs['hash'], artifacts.load(trial)['privatized_data']
+
+    def bisect_e(self, pool=None):
+        """
+        Searches the smallest e on the 0.1 grid whose error is within the upper error bound.
+
+        The estimation error decreases with e, so the error band of
+        _get_error_bounds is bracketed between 0.1 and e_ref and the bracket
+        is halved until an e inside the band is found or the bracket cannot
+        be split. Every probe averages the maximum error of `repetitions`
+        privatizations, so a single noisy run does not move the bracket. With a
+        pool the repetitions of a probe run in parallel.
+
+        Returns:
+            tuple: The chosen e, the hash coefficients and the privatized data of its last privatization.
+        """
+        lower, upper = self._get_error_bounds()
+        simulate = self.simulation == "sketch"
+
+        def probe(e):
+            # Only the privatized data of the last repetition is kept
+            errors = []
+            if pool is None:
+                for _ in range(self.repetitions):
+                    max_error, coeffs, privatized_data = self.evaluate_e(e, simulate)
+                    errors.append(max_error)
+            else:
+                results = pool.map(run_private_client, [(self.privacy_method, self.k, self.m, e, simulate)] * self.repetitions)
+                errors = [self.max_error(df_estimated) for _, _, df_estimated in results]
+                coeffs, privatized_data, _ = results[-1]
+                del results
+            max_error = float(np.mean(errors))
+            print(f"ε = {e}: mean maximum error {max_error:.2f}% (bounds {lower:.2f}% - {upper:.2f}%)")
+            return max_error, coeffs, privatized_data
+
+        # Work on the 0.1 grid of the trials as integer steps
+        lo, hi = 1, max(1, int(round(self.e_ref * 10)))
+        error, coeffs, privatized_data = probe(hi / 10)
+        best = (hi / 10, coeffs, privatized_data)
+        if error > upper or lo == hi:
+            # Not even e_ref meets the error bound, so the most accurate e is kept
+            return best
+
+        error, coeffs, privatized_data = probe(lo / 10)
+        if error <= upper:
+            return lo / 10, coeffs, privatized_data
+
+        # Invariant: the error at lo is above the band and the error at hi is within the bound
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            error, coeffs, privatized_data = probe(mid / 10)
+            if error <= upper:
+                hi, best = mid, (mid / 10, coeffs, privatized_data)
+                if error > lower:
+                    break
+            else:
+                lo = mid
+        return best
     
     def _get_error_bounds(self):
         if self.privacy_level == "high":
@@ -105,15 +224,25 @@ class Mask:
         elif self.privacy_level == "low":
             return 0, (self.error_value-self.tolerance)*100
     
-def run_mask(df):
-    privacy_level = input("Enter the privacy level (high/low): ").strip().lower()
-    if privacy_level not in ["high", "low"]:
-        print("Invalid privacy level. Please enter 'high' or 'low'.")
-        return
-    mask_instance = Mask(privacy_level, df)
-    mask_instance.filter_dataframe()
-    best_e, privatized_data, coeffs = mask_instance.optimize_e()
-    save_mask_json(mask_instance, best_e, coeffs, privatized_data, mask_instance.privacy_method)
+def run_mask(df, simulation="reports", search="optuna", repetitions=3, workers=1, append=False):
+    if append:
+        if not os.path.exists(PRIVATIZED_DATASET):
+            print("❌ There is no privatized dataset to append to. Run mask without -a first.")
+            return
+        # The privacy level only drives the search of e, which is taken from the saved reports
+        mask_instance = Mask(None, df, simulation, search, repetitions, workers)
+        mask_instance.filter_dataframe()
+        best_e, privatized_data, coeffs = mask_instance.privatize_for_append()
+        print(f"➕ Appending {len(privatized_data)} reports privatized with e={best_e}")
+    else:
+        privacy_level = input("Enter the privacy level (high/low): ").strip().lower()
+        if privacy_level not in ["high", "low"]:
+            print("Invalid privacy level. Please enter 'high' or 'low'.")
+            return
+        mask_instance = Mask(privacy_level, df, simulation, search, repetitions, workers)
+        mask_instance.filter_dataframe()
+        best_e, privatized_data, coeffs = mask_instance.optimize_e()
+    save_mask_json(mask_instance, best_e, coeffs, privatized_data, mask_instance.privacy_method, append=append)
     return privatized_data
 
 if __name__ == "__main__":
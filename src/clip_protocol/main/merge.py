@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from clip_protocol.utils.utils import load_sketch_store, save_sketch_store
+from clip_protocol.utils.sketch import Sketch, incompatible_parameters
+
+
+def merge_sketch_stores(paths):
+    """
+    Merges several sketch stores user by user.
+
+    The stores are usually aggregated on different machines from disjoint
+    sets of reports. The sketches of a user that appears in more than one
+    store are added together.
+
+    Args:
+        paths (list): Paths of the stores without extension.
+
+    Returns:
+        tuple: Dictionary with the merged Sketch of every user and the shared metadata.
+    """
+    merged = {}
+    metadata = None
+    for path in paths:
+        users, sketches, N, store_metadata = load_sketch_store(path)
+        if metadata is None:
+            metadata = store_metadata
+        mismatches = incompatible_parameters(metadata, store_metadata)
+        if mismatches:
+            raise ValueError(f"Sketch store {path} cannot be merged, different {', '.join(mismatches)}")
+
+        for i, user_id in enumerate(users):
+            sketch = Sketch(sketches[i], N[i], metadata["k"], metadata["m"], metadata["e"],
+                            metadata["privacy_method"], metadata.get("hash"))
+            merged[user_id] = merged[user_id] + sketch if user_id in merged else sketch
+    return merged, metadata
+
+def run_merge(paths, output):
+    if os.path.abspath(output) in [os.path.abspath(path) for path in paths]:
+        raise ValueError("The merged store cannot overwrite one of the input stores")
+    merged, metadata = merge_sketch_stores(paths)
+    sketch_by_user = {user_id: {"M": sketch.M, "N": sketch.N} for user_id, sketch in merged.items()}
+    save_sketch_store(output, sketch_by_user, metadata)
+    print(f"✅ {len(paths)} sketch stores merged into {output}.npy ({len(sketch_by_user)} users)")
@@ -3,26 +3,30 @@ import pandas as pd
 import numpy as np
 import os
 import sys
-from tabulate import tabulate
 import argparse
 import math
+from contextlib import nullcontext
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from clip_protocol.utils.utils import save_setup_json, get_real_frequency, display_results
-from clip_protocol.utils.errors import compute_error_table, display_error_table
+from clip_protocol.utils.utils import save_setup_json, get_real_frequency, display_results, encode_events
+from clip_protocol.utils.errors import compute_error_table, display_error_table, predict_error
 
-from clip_protocol.count_mean.private_cms_client import run_private_cms_client
-from clip_protocol.hadamard_count_mean.private_hcms_client import run_private_hcms_client
+from clip_protocol.utils.trials import TrialPool, TrialArtifacts, optimize_study, run_private_client
 class Setup:
-    def __init__(self, df):
+    def __init__(self, df, simulation="sketch", workers=1):
         self.df = df
+        # "sketch" samples the private sketch of every trial directly, "reports" privatizes every record
+        self.simulation = simulation
+        # Processes that run the trials in parallel
+        self.workers = workers
         self.e_ref = 20
         self.n_trials = 30
         self.failure_prob = 0.001
+        # Number of (k, m) candidates of the error model that are validated by simulation
+        self.n_finalists = 3
         self.events_names, self.privacy_method, self.error_metric, self.error_value, self.tolerance = self.ask_values()
         self.found_best_values = False
         self.N = len(self.df)
-        self.matching_trial = None
 
     def ask_values(self):
         """
@@ -73,105 +77,146 @@ class Setup:
         self.df = self.df[matching_columns].copy()
         self.df.columns = ["user", "value"]
 
-        self.df['value'] = self.df['value'].astype(str).apply(lambda x: x.strip())
-        self.df = self.df[self.df['value'] != '-']
-        self.df = self.df[self.df['value'].str.contains(r'\w', na=False)]
+        # The events are kept as integer codes into the dictionary of distinct values
+        self.df = encode_events(self.df)
         self.df = self.df.sample(frac=1, random_state=None).reset_index(drop=True)
         self.N = len(self.df)
     
     def run_command(self, e, k, m):
-        if self.privacy_method == "PCMeS":
-            _, _, df_estimated = run_private_cms_client(k, m, e, self.df)
-        elif self.privacy_method == "PHCMS":
-            _, _, df_estimated = run_private_hcms_client(k, m, e, self.df)
-    
+        _, _, df_estimated = run_private_client(self.df, self.privacy_method, k, m, e, self.simulation == "sketch")
         error_table = compute_error_table(self.real_freq, df_estimated, self.p)
         return error_table, df_estimated
+
+    def trial_pool(self):
+        """Returns a pool of trial workers sharing the dataset, or a null context when running in this process."""
+        return TrialPool(self.df, self.workers) if self.workers > 1 else nullcontext()
     
+    def candidate_k_m(self, min_freq_value):
+        """
+        Grid of (k, m) candidates, within the same ranges the trials used to explore.
+
+        Args:
+            min_freq_value (int): Frequency of the least frequent event.
+
+        Returns:
+            list: The (k, m) candidates.
+        """
+        # Calculate the value of the range of m
+        sobreestimation = float(min_freq_value * self.error_value) / self.N
+        m_range = 2.718/sobreestimation
+
+        if self.privacy_method == "PHCMS":
+            # m must be a power of 2
+            m_values = [2 ** int(math.floor(math.log2(m_range)))]
+            k_values = np.geomspace(100, max(100, 1/self.failure_prob), 40)
+        else:
+            m_values = np.linspace(max(2, m_range/2), max(2, m_range), 40)
+            k_values = np.geomspace(10, 1000, 40)
+        k_values = np.unique(np.round(k_values).astype(int))
+        m_values = np.unique(np.round(m_values).astype(int))
+        return [(int(k), int(m)) for m in m_values for k in k_values]
+
     def optimize_k_m(self):
-       
-        def objective(trial):
-            # Choose the event with less frequency
-            self.real_freq = get_real_frequency(self.df)
-            min_freq_value = self.real_freq['Frequency'].min()
-            
-            # Calculate the value of the range of m
-            sobreestimation = float(min_freq_value * self.error_value) / self.N
-            m_range = 2.718/sobreestimation
+        """
+        Chooses k and m with the analytic error model and validates the finalists by simulation.
 
-            if self.privacy_method == "PHCMS":
-                k_range = 1/self.failure_prob
-                k = trial.suggest_int("k", 100, k_range)
-                exp_max = int(math.floor(math.log2(m_range)))
-                m = 2 ** exp_max
-                print(f"m must be a power of 2, so m = {m}")
+        The error of every candidate is predicted at e_ref with predict_error.
+        The candidates predicted to meet the error target are sorted by m and
+        then by k, and only the first n_finalists are simulated. The prediction
+        is a high-probability upper bound, so when no candidate is predicted to
+        meet the target the n_finalists with the lowest predicted error are
+        simulated instead.
 
-            else:
-                k = trial.suggest_int("k", 10, 1000)
-                m = trial.suggest_int("m", m_range/2, m_range)
+        Returns:
+            tuple: The chosen k and m.
+        """
+        self.real_freq = get_real_frequency(self.df)
+        frequencies = self.real_freq['Frequency'].to_numpy()
+        min_freq_value = frequencies.min()
+        target = self.error_value * min_freq_value
 
-            trial.set_user_attr('k', k)
-            trial.set_user_attr('m', m)
-                     
-            error_table, _ = self.run_command(self.e_ref, k, m)  
-            error = float([v for k, v in error_table if k == self.error_metric][0])
+        predictions = [
+            (predict_error(frequencies, k, m, self.e_ref, self.privacy_method, self.error_metric, self.p, self.failure_prob), k, m)
+            for k, m in self.candidate_k_m(min_freq_value)
+        ]
+        shortlist = sorted((m, k, error) for error, k, m in predictions if error <= target)
+        print(f"🔍 {len(shortlist)} of {len(predictions)} (k, m) candidates are predicted to meet the error {target:.2f}")
 
-            print(f"Error: {error}, Error value: {self.error_value * min_freq_value}")
-            if error <= (self.error_value * min_freq_value):
-                self.found_best_values = True
-                self.matching_trial = trial
-                trial.study.stop()
-            
-            return m
-        
-        study = optuna.create_study(direction="minimize")
-        study.optimize(objective, n_trials=self.n_trials)
+        if not shortlist:
+            # The model only ranks the candidates then, the simulation decides
+            shortlist = [(m, k, error) for error, k, m in sorted(predictions)]
 
-        if self.matching_trial is not None:
-            trial = self.matching_trial
+        finalists = shortlist[:self.n_finalists]
+        if self.workers > 1 and len(finalists) > 1:
+            # The finalists are simulated at once and then checked in order
+            with self.trial_pool() as pool:
+                args = [(self.privacy_method, k, m, self.e_ref, self.simulation == "sketch") for m, k, _ in finalists]
+                estimates = [df_estimated for _, _, df_estimated in pool.map(run_private_client, args)]
         else:
-            trial = study.best_trial
-        
-        return trial.user_attrs["k"], trial.user_attrs["m"]
+            estimates = [None] * len(finalists)
+
+        for (m, k, predicted), df_estimated in zip(finalists, estimates):
+            if df_estimated is None:
+                error_table, _ = self.run_command(self.e_ref, k, m)
+            else:
+                error_table = compute_error_table(self.real_freq, df_estimated, self.p)
+            error = float([v for name, v in error_table if name == self.error_metric][0])
+
+            print(f"k={k}, m={m}, Error: {error}, Predicted error: {predicted:.2f}, Error value: {target}")
+            if error <= target:
+                self.found_best_values = True
+                return k, m
+
+        # Without a valid candidate, keep the one closest to the target
+        _, k, m = min(predictions)
+        return k, m
     
     def minimize_epsilon(self, k, m):
-        matching_trial = {"trial": None}
-        def objective(trial):
+        real = get_real_frequency(self.df)
+        # Only the estimates of the trials that can still be chosen are kept
+        artifacts = TrialArtifacts()
+        def suggest(trial):
             e = trial.suggest_int("e", 1, self.e_ref)
+            return self.privacy_method, k, m, e, self.simulation == "sketch"
 
-            _, df_estimated = self.run_command(self.e_ref, k, m)
+        def record(trial, args, result):
+            e = args[3]
+            _, _, df_estimated = result
 
-            trial.set_user_attr('real', get_real_frequency(self.df))
-            trial.set_user_attr('estimated', df_estimated)
             trial.set_user_attr('e', e)
-            table = display_results(get_real_frequency(self.df), df_estimated)
+            table = display_results(real, df_estimated)
             percentage_errors = [float(row[-1].strip('%')) for row in table]
             max_error = max(percentage_errors)
 
             print(f"Max error: {max_error}")
             print(f"Error value: {self.error_value * 100}")
 
-            if max_error <= (self.error_value * 100):
-                matching_trial["trial"] = trial
-                trial.study.stop()
+            stop = max_error <= (self.error_value * 100)
+            artifacts.record(trial, e, {'estimated': df_estimated}, matching=stop)
             
-            return e
+            return e, stop
         
         study = optuna.create_study(direction="minimize")
-        study.optimize(objective, n_trials=self.n_trials)
+        with self.trial_pool() as pool:
+            optimize_study(study, self.n_trials, suggest, record, run_private_client, self.df, pool)
 
-        final_trial = matching_trial["trial"] or study.best_trial
+        final_trial = artifacts.chosen(study)
 
-        real = final_trial.user_attrs['real']
-        estimated = final_trial.user_attrs['estimated']
+        estimated = artifacts.load(final_trial)['estimated']
 
         display_error_table(real, estimated, self.p)
 
         return final_trial.user_attrs["e"]
 
-def run_setup(df):
+def run_setup(df, simulation="sketch", workers=1):
     """
     Main function to run the setup process.
+
+    Args:
+        df (pandas.DataFrame): Input dataset.
+        simulation (str): "sketch" to sample the private sketches of the trials directly,
+            "reports" to privatize every record.
+        workers (int): Processes that run the trials in parallel.
     """
     df_temp = df.copy()
     if any(col.startswith("Unnamed") for col in df_temp.columns):
@@ -179,7 +224,7 @@ def run_setup(df):
     else:
         df = df_temp
 
-    setup_instance = Setup(df)
+    setup_instance = Setup(df, simulation, workers)
     setup_instance.filter_dataframe()
 
     while not setup_instance.found_best_values:
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from clip_protocol.utils.jit import NUMBA_CACHE_DIR
+from clip_protocol.utils.utils import report_dtype, records_to_reports
+from clip_protocol.count_mean.private_cms_client import sum_reports
+from clip_protocol.count_mean.private_cms_client import update_sketch_matrix as update_cms_matrix
+from clip_protocol.count_mean.report_batch import ReportBatch, sum_packed_reports
+from clip_protocol.hadamard_count_mean.private_hcms_client import fwht_rows
+from clip_protocol.hadamard_count_mean.private_hcms_client import update_sketch_matrix as update_hcms_matrix
+
+
+def kernel_calls(k=16, m=1024, n=4096):
+    """
+    Builds one call of every numba kernel with the argument types used by the pipeline.
+
+    Args:
+        k (int): Number of hash functions.
+        m (int): Size of the sketch, a power of 2.
+        n (int): Number of reports of the batch kernels.
+
+    Returns:
+        list: (name, kernel, call, items) tuples, call runs the kernel once over items elements.
+    """
+    rng = np.random.default_rng(0)
+    V = np.where(rng.random((n, m)) < 0.5, 1, -1).astype(np.int8)
+    J = rng.integers(0, k, size=n)
+    batch = ReportBatch.from_vectors(V, J, np.zeros(n, dtype=object))
+
+    # Reports read back from a report file view the packed vectors of the records
+    records = np.zeros(n, dtype=report_dtype("PCMeS", m, 16))
+    records["v"] = batch.bits
+    records["j"] = J
+    records.flags.writeable = False
+    stored = records_to_reports(records, "PCMeS", m)
+
+    M = np.zeros((k, m))
+    # 32-bit sums accumulate the reports of float32 and int32 sketches
+    R = np.zeros((k, m), dtype=np.int32)
+    S = np.zeros((k, m), dtype=np.int64)
+    counts = np.zeros(k, dtype=np.int64)
+    # Single reports added by the servers, as iterated from a ReportBatch
+    v = np.full(m, -1, dtype=np.int8)
+    return [
+        ("update_sketch_matrix (PCMeS)", update_cms_matrix, lambda: update_cms_matrix(S, counts, v, 0), m),
+        ("sum_reports", sum_reports, lambda: sum_reports(S, counts, V, J), n * m),
+        ("sum_reports (int32)", sum_reports, lambda: sum_reports(R, counts, V, J), n * m),
+        ("sum_packed_reports", sum_packed_reports, lambda: sum_packed_reports(S, counts, batch.bits, batch.j), n * m),
+        ("sum_packed_reports (int32)", sum_packed_reports,
+         lambda: sum_packed_reports(R, counts, batch.bits, batch.j), n * m),
+        ("sum_packed_reports (report file)", sum_packed_reports,
+         lambda: sum_packed_reports(S, counts, stored.bits, stored.j), n * m),
+        ("sum_packed_reports (report file, int32)", sum_packed_reports,
+         lambda: sum_packed_reports(R, counts, stored.bits, stored.j), n * m),
+        ("update_sketch_matrix (PHCMS)", update_hcms_matrix, lambda: update_hcms_matrix(S, counts, 1, 0, 0), 1),
+        ("fwht_rows", fwht_rows, lambda: fwht_rows(M), k * m),
+        ("fwht_rows (int32)", fwht_rows, lambda: fwht_rows(R), k * m),
+        ("fwht_rows (int64)", fwht_rows, lambda: fwht_rows(S), k * m),
+    ]
+
+def measure_kernel(kernel, call, items, duration):
+    """
+    Times the first call of a kernel apart from its steady-state throughput.
+
+    Args:
+        kernel (numba.core.registry.CPUDispatcher): Kernel being measured.
+        call (callable): Runs the kernel once.
+        items (int): Elements processed by every call.
+        duration (float): Seconds spent measuring the steady state.
+
+    Returns:
+        tuple: First call time in ms, whether it was loaded from the cache, and elements per second.
+    """
+    hits = sum(kernel.stats.cache_hits.values())
+    start = time.perf_counter()
+    call()
+    first_call = (time.perf_counter() - start) * 1000
+    cached = sum(kernel.stats.cache_hits.values()) > hits
+
+    calls = 0
+    start = time.perf_counter()
+    while calls == 0 or time.perf_counter() - start < duration:
+        call()
+        calls += 1
+    throughput = calls * items / (time.perf_counter() - start)
+    return first_call, cached, throughput
+
+def run_warmup(duration=0.2):
+    """
+    Compiles every numba kernel into the on-disk cache and reports its startup and steady-state cost.
+
+    Args:
+        duration (float): Seconds spent measuring the throughput of every kernel.
+    """
+    print(f"🔥 Warming up the numba kernels (cache in {NUMBA_CACHE_DIR})")
+    rows = []
+    for name, kernel, call, items in kernel_calls():
+        first_call, cached, throughput = measure_kernel(kernel, call, items, duration)
+        rows.append([name, f"{first_call:.1f}", "loaded" if cached else "compiled", f"{throughput:,.0f}"])
+    print(tabulate(rows, headers=["Kernel", "First call (ms)", "Cache", "Steady state (elements/s)"], tablefmt="fancy_grid"))
+    print("✅ Kernels compiled and cached")
@@ -1,30 +1,24 @@
 import numpy as np
 import pandas as pd
 from tabulate import tabulate
+from scipy.stats import norm
+from scipy.special import gamma
 
-def compute_error_table(real_freq, estimated_freq, p):
-    # Turn both into dictionaries {element: frequency}
-    real_num_freq = dict(zip(real_freq['Element'], real_freq['Frequency']))
-    estimated_num_freq = dict(zip(estimated_freq['Element'], estimated_freq['Frequency']))
-
-    N = sum(real_num_freq.values())
+def frequency_differences(real_freq, estimated_freq):
+    """Returns the real minus the estimated frequency of every element of either table, 0 where an element is missing."""
+    real = pd.Series(real_freq['Frequency'].to_numpy(dtype=np.float64), index=real_freq['Element'].to_numpy())
+    estimated = pd.Series(estimated_freq['Frequency'].to_numpy(dtype=np.float64), index=estimated_freq['Element'].to_numpy())
+    # Both tables are aligned on their elements at once
+    return real.sub(estimated, fill_value=0).to_numpy()
 
-    # Join both dictionaries to get all elements
-    all_elements = set(real_num_freq.keys()).union(estimated_num_freq.keys())
-
-    # Calculate error
-    errors = [
-        abs(real_num_freq.get(key, 0) - estimated_num_freq.get(key, 0))
-        for key in all_elements
-    ]
+def compute_error_table(real_freq, estimated_freq, p):
+    N = real_freq['Frequency'].sum()
+    errors = np.abs(frequency_differences(real_freq, estimated_freq))
 
     mean_error = np.mean(errors)
-    mse = np.mean([(real_num_freq.get(key, 0) - estimated_num_freq.get(key, 0)) ** 2 
-                  for key in all_elements])
-    mae = np.mean([abs(real_num_freq.get(key, 0) - estimated_num_freq.get(key, 0)) 
-                  for key in all_elements])
-    lp = np.sum([abs(real_num_freq.get(key, 0) - estimated_num_freq.get(key, 0)) ** p 
-                  for key in all_elements]) ** (1/p)
+    mse = np.mean(errors ** 2)
+    mae = mean_error
+    lp = np.sum(errors ** p) ** (1/p)
 
     error_table = [
         ['MAE', f"{mae:.2f}"],
@@ -41,11 +35,95 @@ def display_error_table(real_freq, estimated_freq, p):
 
 
 def calculate_lp(real_freq, estimated_freq, p):
-    real_num_freq = dict(zip(real_freq['Element'], real_freq['Frequency']))
-    estimated_num_freq = dict(zip(estimated_freq['Element'], estimated_freq['Frequency']))
+    errors = np.abs(frequency_differences(real_freq, estimated_freq))
+    lp = np.sum(errors ** p) ** (1/p)
+    return lp
+
+def sketch_error_moments(frequencies, k, m, e, privacy_method):
+    """
+    Mean and standard deviation of the estimation error of every element.
+
+    PCMeS estimates are unbiased. Their variance is the noise of the flips,
+    N(c_e^2-1)/4, plus the reports of other elements whose row collides
+    with the element, over the randomness of the rows and the hash functions.
+    The PHCMS clients flip the sign with epsilon but the server scales by the
+    constant of epsilon/2, so its estimates are scaled up by c'/c and every
+    report adds a variance of about c'^2.
+
+    Args:
+        frequencies (numpy.ndarray): Real frequency of every element of the domain.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter.
+        privacy_method (str): "PCMeS" or "PHCMS".
+
+    Returns:
+        tuple: Arrays with the mean and the standard deviation of the error of every element.
+    """
+    f = np.asarray(frequencies, dtype=np.float64)
+    N = f.sum()
+    scale = m / (m - 1)
+
+    # Reports of other elements that land on the counters of the element
+    collisions = f.sum() - f
+    collision_var = (collisions / m) * (1 - 1 / m) + (np.sum(f ** 2) - f ** 2) / (k * m) * (1 - 1 / m)
+
+    if privacy_method == "PCMeS":
+        c_e = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
+        mean = np.zeros_like(f)
+        var = scale ** 2 * (N * (c_e ** 2 - 1) / 4 + collision_var)
+    elif privacy_method == "PHCMS":
+        c_server = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
+        c_client = (np.exp(e) + 1) / (np.exp(e) - 1)
+        ratio = c_server / c_client
+        mean = scale * (ratio * (f + collisions / m) - N / m) - f
+        var = scale ** 2 * (N * c_server ** 2 + ratio ** 2 * collision_var)
+    else:
+        raise ValueError(f"Unknown privacy method: {privacy_method}")
+    return mean, np.sqrt(var)
+
+def predict_error(frequencies, k, m, e, privacy_method, error_metric, p=1.5, failure_prob=0.001):
+    """
+    Predicts an upper bound of an error metric without running a simulation.
+
+    The error of every element is modelled as a Gaussian with the moments of
+    sketch_error_moments. The metric averages (or sums) a function of those
+    errors, so its mean and variance follow from the Gaussian moments, and the
+    bound is the metric that is only exceeded with probability failure_prob.
+
+    Args:
+        frequencies (numpy.ndarray): Real frequency of every element of the domain.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter.
+        privacy_method (str): "PCMeS" or "PHCMS".
+        error_metric (str): "MAE", "MSE", "RMSE" or "Lρ Norm", as in compute_error_table.
+        p (float): Order of the Lρ norm.
+        failure_prob (float): Probability of the metric exceeding the bound.
 
-    all_elements = set(real_num_freq.keys()).union(estimated_num_freq.keys())
+    Returns:
+        float: Predicted upper bound of the metric.
+    """
+    mean, std = sketch_error_moments(frequencies, k, m, e, privacy_method)
+    z = norm.ppf(1 - failure_prob)
+    n = len(mean)
 
-    lp = np.sum([abs(real_num_freq.get(key, 0) - estimated_num_freq.get(key, 0)) ** p 
-                  for key in all_elements]) ** (1/p)
-    return lp
\ No newline at end of file
+    if error_metric == "MAE":
+        # Moments of a folded normal
+        abs_mean = std * np.sqrt(2 / np.pi) * np.exp(-mean ** 2 / (2 * std ** 2)) + mean * (1 - 2 * norm.cdf(-mean / std))
+        abs_var = std ** 2 + mean ** 2 - abs_mean ** 2
+        return float(np.mean(abs_mean) + z * np.sqrt(np.sum(abs_var)) / n)
+    if error_metric in ("MSE", "RMSE"):
+        sq_mean = std ** 2 + mean ** 2
+        sq_var = 2 * std ** 4 + 4 * mean ** 2 * std ** 2
+        mse = np.mean(sq_mean) + z * np.sqrt(np.sum(sq_var)) / n
+        return float(mse if error_metric == "MSE" else np.sqrt(mse))
+    if error_metric == "Lρ Norm":
+        # Absolute moments of a centered normal with the same second moment
+        sigma = np.sqrt(std ** 2 + mean ** 2)
+        def abs_moment(q):
+            return sigma ** q * 2 ** (q / 2) * gamma((q + 1) / 2) / np.sqrt(np.pi)
+        pow_var = abs_moment(2 * p) - abs_moment(p) ** 2
+        total = np.sum(abs_moment(p)) + z * np.sqrt(np.sum(pow_var))
+        return float(total ** (1 / p))
+    raise ValueError(f"Unknown error metric: {error_metric}")
@@ -0,0 +1,23 @@
+import os
+from appdirs import user_cache_dir
+
+from clip_protocol.utils.utils import APP_NAME
+
+# The compiled kernels are cached in the user cache folder, so only the first
+# process that runs a kernel for the installed numpy/numba compiles it. It is
+# kept apart from the data folder, which clip_clear empties. The variable must
+# be set before numba is imported, an existing value is kept.
+NUMBA_CACHE_DIR = os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(user_cache_dir(APP_NAME), "numba"))
+
+import numba
+
+if not numba.config.CACHE_DIR:
+    # numba was imported before this module and did not read the variable
+    numba.config.CACHE_DIR = os.environ["NUMBA_CACHE_DIR"]
+
+prange = numba.prange
+
+def njit(*args, **kwargs):
+    """numba.njit caching the compiled kernel on disk, used as @njit or @njit(parallel=True)."""
+    kwargs.setdefault("cache", True)
+    return numba.njit(*args, **kwargs)
@@ -0,0 +1,215 @@
+import numpy as np
+
+
+# Sketch matrix types: float sketches hold the scaled sketch values, integer
+# sketches the raw sums of the reports, scaled when they are queried
+SKETCH_DTYPES = ("float64", "float32", "int32")
+
+def is_raw(dtype):
+    """Returns whether sketches of the given dtype hold the raw sums of the reports."""
+    return np.issubdtype(np.dtype(dtype), np.integer)
+
+def debias_estimate(total, N, k, m, e, privacy_method, raw=False):
+    """
+    Turns the sum of the k sketch cells of an element into its estimated frequency.
+
+    A float sketch holds the scaled values, so the mean of the cells is
+    total / k. A raw PCMeS sketch holds the sums of the ±1 vectors and a raw
+    PHCMS sketch the transformed sums of the w bits, whose scaled mean is
+    c_e/2·total + N/2 and c_e·total, as the k rows add up to N reports.
+
+    Args:
+        total (float or numpy.ndarray): Sum over the k rows of the cells of the element.
+        N (int or numpy.ndarray): Number of reports of the sketch.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter used by the clients.
+        privacy_method (str): "PCMeS" or "PHCMS".
+        raw (bool): Whether the sketch holds the raw sums.
+
+    Returns:
+        float or numpy.ndarray: The estimated frequency.
+    """
+    if not raw:
+        mean = total / k
+    else:
+        c_e = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
+        mean = (c_e / 2) * total + N / 2 if privacy_method == "PCMeS" else c_e * total
+    return (m / (m - 1)) * (mean - N / m)
+
+class SketchAccumulator:
+    """
+    Exact integer sums of the reports added to a sketch.
+
+    A PCMeS accumulator keeps the sums of the ±1 vectors of every row and a
+    PHCMS accumulator the sums of the w bits of every cell in the Hadamard
+    domain, both with the number of reports of every row j. Adding reports
+    only takes integer additions, two accumulators merge exactly, and the
+    c_e scaling is applied once by materialize, for any epsilon.
+
+    Attributes:
+        S (numpy.ndarray): (k, m) integer sums of the reports.
+        counts (numpy.ndarray): Number of reports of every row.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        privacy_method (str): "PCMeS" or "PHCMS".
+    """
+    def __init__(self, k, m, privacy_method, dtype=np.int64):
+        self.S = np.zeros((k, m), dtype=dtype)
+        self.counts = np.zeros(k, dtype=np.int64)
+        self.k = k
+        self.m = m
+        self.privacy_method = privacy_method
+
+    @property
+    def N(self):
+        """Number of reports added."""
+        return int(self.counts.sum())
+
+    def add_row_sums(self, S, counts):
+        """Adds per-row sums of PCMeS ±1 vectors and the number of vectors of every row."""
+        self.S += S.astype(self.S.dtype, copy=False)
+        self.counts += counts
+
+    def add_hadamard_reports(self, w, j, l):
+        """Adds PHCMS reports given as arrays with the ±1 bit, the row and the coefficient of every report."""
+        j = np.asarray(j, dtype=np.int64)
+        sums = np.bincount(j * self.m + l, weights=w, minlength=self.k * self.m)
+        self.S += np.rint(sums).astype(self.S.dtype).reshape(self.k, self.m)
+        self.counts += np.bincount(j, minlength=self.k)
+
+    def raw(self):
+        """Returns the raw sketch: the sums for PCMeS, and the transformed sums for PHCMS."""
+        if self.privacy_method == "PHCMS":
+            # Imported here so that estimating from stored sketches does not load numba
+            from clip_protocol.hadamard_count_mean.private_hcms_client import traspose_M
+            return traspose_M(self.S)
+        return self.S.copy()
+
+    def materialize(self, e, dtype="float64"):
+        """
+        Scales the sums into the sketch matrix of the privacy method.
+
+        Args:
+            e (float): Privacy parameter the c_e scaling is computed with.
+            dtype (str): Type of the sketch, integer types return the raw sketch.
+
+        Returns:
+            numpy.ndarray: The (k, m) sketch matrix.
+        """
+        R = self.raw()
+        if is_raw(dtype):
+            return R.astype(dtype)
+        c_e = (np.exp(e / 2) + 1) / (np.exp(e / 2) - 1)
+        if self.privacy_method == "PCMeS":
+            M = self.k * ((c_e / 2) * R + (1 / 2) * self.counts[:, None])
+        else:
+            M = self.k * c_e * R
+        return M.astype(dtype, copy=False)
+
+    def merge(self, other):
+        """
+        Merges two accumulators built from disjoint sets of reports.
+
+        Raises:
+            ValueError: If k, m or the privacy method differ.
+        """
+        mismatches = [name for name in ("k", "m", "privacy_method") if getattr(self, name) != getattr(other, name)]
+        if mismatches:
+            raise ValueError(f"Accumulators cannot be merged, different {', '.join(mismatches)}")
+        merged = SketchAccumulator(self.k, self.m, self.privacy_method, np.result_type(self.S, other.S))
+        merged.S = self.S + other.S
+        merged.counts = self.counts + other.counts
+        return merged
+
+    def __add__(self, other):
+        return self.merge(other)
+
+class Sketch:
+    """
+    Private sketch built from a collection of privatized reports.
+
+    The PCMeS and PHCMS sketches are linear in the reports, so two sketches
+    built with the same k, m, epsilon, privacy method and hash coefficients
+    can be merged by adding their matrices and their number of reports.
+    Integer sketches hold the raw sums of the reports (see SKETCH_DTYPES).
+
+    Attributes:
+        M (numpy.ndarray): (k, m) sketch matrix.
+        N (int): Number of reports added to the sketch.
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter used by the clients.
+        privacy_method (str): "PCMeS" or "PHCMS".
+        hash_params (dict): Parameters of the hash family saved by the mask step.
+    """
+    def __init__(self, M, N, k, m, e, privacy_method, hash_params):
+        self.M = np.asarray(M)
+        self.N = int(N)
+        self.k = k
+        self.m = m
+        self.e = e
+        self.privacy_method = privacy_method
+        self.hash_params = hash_params
+
+    @classmethod
+    def empty(cls, k, m, e, privacy_method, hash_params, dtype="float64"):
+        """Returns a sketch without reports."""
+        return cls(np.zeros((k, m), dtype=dtype), 0, k, m, e, privacy_method, hash_params)
+
+    def parameters(self):
+        """Returns the parameters two sketches must share to be merged."""
+        return {
+            "k": self.k,
+            "m": self.m,
+            "e": self.e,
+            "privacy_method": self.privacy_method,
+            "hash": self.hash_params,
+            "dtype": self.M.dtype.name,
+        }
+
+    def check_compatible(self, other):
+        """
+        Checks that other was built with the same parameters as this sketch.
+
+        Raises:
+            ValueError: If any of k, m, e, the privacy method or the hash coefficients differ,
+                or if only one of the sketches holds raw sums.
+        """
+        mismatches = incompatible_parameters(self.parameters(), other.parameters())
+        if mismatches:
+            raise ValueError(f"Sketches cannot be merged, different {', '.join(mismatches)}")
+
+    def merge(self, other):
+        """
+        Merges two sketches built from disjoint sets of reports.
+
+        Args:
+            other (Sketch): Sketch built with the same parameters.
+
+        Returns:
+            Sketch: A new sketch holding the reports of both sketches.
+        """
+        self.check_compatible(other)
+        return Sketch(self.M + other.M, self.N + other.N, self.k, self.m, self.e,
+                      self.privacy_method, self.hash_params)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+def incompatible_parameters(params, other_params):
+    """
+    Compares the parameters of two sketches or sketch stores.
+
+    Returns:
+        list: Names of the parameters that differ.
+    """
+    mismatches = [name for name in ("k", "m", "privacy_method") if params[name] != other_params[name]]
+    if not np.isclose(params["e"], other_params["e"]):
+        mismatches.append("e")
+    if params.get("hash") != other_params.get("hash"):
+        mismatches.append("hash coefficients")
+    # Stores saved before the dtype option hold float64 sketches
+    if is_raw(params.get("dtype", "float64")) != is_raw(other_params.get("dtype", "float64")):
+        mismatches.append("dtype")
+    return mismatches
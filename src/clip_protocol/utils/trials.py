@@ -0,0 +1,206 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+
+def run_private_client(df, privacy_method, k, m, e, simulate=False, hash_params=None):
+    """
+    Privatizes a dataset with the client of a privacy method and estimates the frequencies.
+
+    Args:
+        df (pandas.DataFrame): Dataset with the "user" and "value" columns.
+        privacy_method (str): "PCMeS" or "PHCMS".
+        k (int): Number of hash functions.
+        m (int): Size of the sketch.
+        e (float): Privacy parameter.
+        simulate (bool): Sample the sketch directly instead of privatizing every record.
+        hash_params (dict, optional): Parameters of the hash family to reuse, a new one is drawn by default.
+
+    Returns:
+        tuple: The hash coefficients, the privatized data and the estimated frequency DataFrame.
+    """
+    # Imported here so that the workers only load the client they use
+    if privacy_method == "PCMeS":
+        from clip_protocol.count_mean.private_cms_client import run_private_cms_client
+        return run_private_cms_client(k, m, e, df, simulate, hash_params=hash_params)
+    elif privacy_method == "PHCMS":
+        from clip_protocol.hadamard_count_mean.private_hcms_client import run_private_hcms_client
+        return run_private_hcms_client(k, m, e, df, simulate, hash_params=hash_params)
+    raise ValueError(f"Unknown privacy method: {privacy_method}")
+
+class SharedDataFrame:
+    """
+    Columns of a DataFrame dictionary-encoded into shared memory.
+
+    Every column is stored as int32 codes in a shared memory block, and its
+    distinct values travel once to every worker, which rebuilds the column
+    as a pandas Categorical over the shared codes without copying them.
+
+    Attributes:
+        descriptor (dict): Maps every column to the block name, the number of rows and the categories.
+    """
+    def __init__(self, df, columns=("user", "value")):
+        self.blocks = []
+        self.descriptor = {}
+        for column in columns:
+            codes, categories = pd.factorize(df[column])
+            shm = shared_memory.SharedMemory(create=True, size=max(1, codes.size * 4))
+            np.ndarray(codes.shape, dtype=np.int32, buffer=shm.buf)[:] = codes
+            self.blocks.append(shm)
+            self.descriptor[column] = (shm.name, codes.size, categories.tolist())
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+def attach_dataframe(descriptor):
+    """
+    Rebuilds a DataFrame shared with SharedDataFrame.
+
+    Returns:
+        tuple: The DataFrame and the shared memory blocks, which must stay open while it is used.
+    """
+    blocks, columns = [], {}
+    for column, (name, size, categories) in descriptor.items():
+        shm = shared_memory.SharedMemory(name=name)
+        codes = np.ndarray((size,), dtype=np.int32, buffer=shm.buf)
+        columns[column] = pd.Categorical.from_codes(codes, categories)
+        blocks.append(shm)
+    return pd.DataFrame(columns), blocks
+
+# Dataset of the trial worker processes, attached once per worker
+_worker_df = None
+_worker_blocks = None
+
+def _init_worker(descriptor):
+    global _worker_df, _worker_blocks
+    _worker_df, _worker_blocks = attach_dataframe(descriptor)
+
+def _run_job(job, args):
+    return job(_worker_df, *args)
+
+class TrialPool:
+    """
+    Pool of worker processes that run trials over a dataset in shared memory.
+
+    Jobs are top-level functions called as job(df, *args) in the workers.
+
+    Attributes:
+        workers (int): Number of worker processes.
+    """
+    def __init__(self, df, workers):
+        self.workers = workers
+        self.shared = SharedDataFrame(df)
+        # Spawned workers do not inherit the numba thread pool
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                            initargs=(self.shared.descriptor,))
+
+    def submit(self, job, *args):
+        return self.executor.submit(_run_job, job, args)
+
+    def map(self, job, args_list):
+        futures = [self.submit(job, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown()
+        self.shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def optimize_study(study, n_trials, suggest, record, job, df, pool=None):
+    """
+    Runs the trials of an Optuna study, in parallel when a pool is given.
+
+    In parallel the trials are created with study.ask, run in the workers
+    and reported back with study.tell as they finish. Once a trial asks to
+    stop, no more trials are started and the running ones are reported.
+
+    Args:
+        study (optuna.Study): Study the trials are reported to.
+        n_trials (int): Maximum number of trials.
+        suggest (callable): Suggests the parameters of a trial and returns the arguments of job.
+        record (callable): Called with the trial, its arguments and the result of job.
+            Returns the objective value and whether the study should stop.
+        job (callable): Top-level function called as job(df, *args).
+        df (pandas.DataFrame): Dataset of the trials when they run in this process.
+        pool (TrialPool, optional): Workers that run the trials.
+    """
+    if pool is None:
+        def objective(trial):
+            args = suggest(trial)
+            value, stop = record(trial, args, job(df, *args))
+            if stop:
+                trial.study.stop()
+            return value
+        study.optimize(objective, n_trials=n_trials)
+        return
+
+    pending, asked, stop = {}, 0, False
+    while pending or (not stop and asked < n_trials):
+        while not stop and asked < n_trials and len(pending) < pool.workers:
+            trial = study.ask()
+            args = suggest(trial)
+            pending[pool.submit(job, *args)] = (trial, args)
+            asked += 1
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            trial, args = pending.pop(future)
+            value, stop_trial = record(trial, args, future.result())
+            study.tell(trial, value)
+            stop = stop or stop_trial
+
+class TrialArtifacts:
+    """
+    Keeps the large artifacts of the trials that can still be chosen.
+
+    A study ends with its best matching trial or, without one, with its best
+    trial, so only the artifacts of those two are kept. In parallel several
+    trials can match before the stop is reported, and the matching trial
+    with the lowest value wins whatever order they finished in. The
+    artifacts of any other trial are dropped as soon as it is recorded, and
+    memory does not grow with the number of trials. Studies are assumed to
+    minimize.
+    """
+    def __init__(self):
+        self.kept = {}
+        self.best = None
+        self.matching = None
+
+    def record(self, trial, value, artifacts, matching=False):
+        """
+        Records the objective value of a trial and keeps its artifacts if it can be chosen.
+
+        Args:
+            trial (optuna.Trial): Trial being recorded.
+            value (float): Objective value of the trial.
+            artifacts (dict): Artifacts of the trial.
+            matching (bool): Whether the trial meets the target of the study.
+        """
+        # Ties keep the earliest trial, like study.best_trial
+        if matching and (self.matching is None or (value, trial.number) < self.matching):
+            self.matching = (value, trial.number)
+        if self.best is None or (value, trial.number) < self.best:
+            self.best = (value, trial.number)
+        keep = {self.best[1], self.matching[1] if self.matching else None}
+        if trial.number in keep:
+            self.kept[trial.number] = artifacts
+        self.kept = {number: kept for number, kept in self.kept.items() if number in keep}
+
+    def chosen(self, study):
+        """Returns the matching trial of the study with the lowest value or, without one, its best trial."""
+        number = self.matching[1] if self.matching is not None else self.best[1]
+        return study.trials[number]
+
+    def load(self, trial):
+        """Returns the artifacts of a kept trial."""
+        return self.kept[trial.number]
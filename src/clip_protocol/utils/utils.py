@@ -1,19 +1,39 @@
 import numpy as np
-import pandas as pd
 import random
 import json
 import os
-import pickle
 import hashlib
+from collections import OrderedDict
+from functools import partial
+from typing import TYPE_CHECKING
 from appdirs import user_data_dir
 
+from clip_protocol.utils.sketch import SketchAccumulator
+
+if TYPE_CHECKING:
+    # pandas is imported by the functions that use it, so the commands that only read sketches do not load it
+    import pandas as pd
+
 APP_NAME = "clip_protocol"
 DATA_DIR = user_data_dir(APP_NAME)
 CONFIG_FILE = os.path.join(DATA_DIR, "setup_config.json")
 CONFIG_MASK = os.path.join(DATA_DIR, "mask_config.json")
 CONFIG_AGREGATE = os.path.join(DATA_DIR, "sketch_by_user")
-PRIVATIZED_DATASET = os.path.join(DATA_DIR, "privatized_dataset.csv")
-os.makedirs(DATA_DIR, exist_ok=True)
+PRIVATIZED_DATASET = os.path.join(DATA_DIR, "privatized_dataset.bin")
+AGREGATE_CHECKPOINT = os.path.join(DATA_DIR, "agregate_checkpoint.npz")
+
+def ensure_data_dir():
+    """
+    Creates the data directory of the application if it does not exist yet.
+
+    It is called right before writing to the directory, so importing this
+    module or running a command that only reads has no filesystem side effects.
+
+    Returns:
+        str: Path of the data directory.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return DATA_DIR
 
 def save_setup_json(setup_instance):
     config = {
@@ -28,6 +48,7 @@ def save_setup_json(setup_instance):
         "tolerance": setup_instance.tolerance,
         "p": setup_instance.p if hasattr(setup_instance, 'p') else None,
     }
+    ensure_data_dir()
     with open(CONFIG_FILE, "w") as f:
         json.dump(config, f)
         print("✅ Setup configuration saved")
@@ -38,7 +59,137 @@ def load_setup_json():
 
     return config["k"], config["m"], config["e_ref"], config["n_trials"], config["events_names"], config["privacy_method"], config["error_metric"], config["error_value"], config["tolerance"], config["p"]
 
-def save_mask_json(mask_instance, e, coeffs, privatized_dataset, privacy_method):
+REPORT_FILE_MAGIC = b"CLIPREP1"
+REPORT_FILE_ALIGN = 64
+
+def report_dtype(privacy_method, m, user_width):
+    """
+    Returns the numpy record type of the reports of a privacy method.
+
+    PCMeS records hold the bit-packed ±1 vector and j, PHCMS records hold
+    (w, j, l). Every record ends with the user as fixed-width UTF-8 bytes.
+
+    Args:
+        privacy_method (str): "PCMeS" or "PHCMS".
+        m (int): Size of the sketch.
+        user_width (int): Bytes reserved for the user of every report.
+
+    Returns:
+        numpy.dtype: Record type.
+    """
+    if privacy_method == "PCMeS":
+        fields = [("v", np.uint8, ((m + 7) // 8,)), ("j", "<i4")]
+    elif privacy_method == "PHCMS":
+        fields = [("w", "<i1"), ("j", "<i4"), ("l", "<i4")]
+    else:
+        raise ValueError(f"Unknown privacy method: {privacy_method}")
+    return np.dtype(fields + [("user", f"S{user_width}")])
+
+def reports_to_records(reports, privacy_method, m, user_width):
+    """Converts a ReportBatch or a list of PCMeS (v, j, user) / PHCMS (w, j, l, user) reports into records."""
+    # Imported here so that the commands that only read sketches do not load numba
+    from clip_protocol.count_mean.report_batch import ReportBatch
+    if privacy_method == "PCMeS" and not isinstance(reports, ReportBatch):
+        reports = ReportBatch.from_vectors(np.stack([r[0] for r in reports]), [r[1] for r in reports], [r[2] for r in reports])
+    users = [str(u).encode("utf-8") for u in (reports.users if isinstance(reports, ReportBatch) else [r[-1] for r in reports])]
+    if users and max(map(len, users)) > user_width:
+        raise ValueError(f"User identifiers longer than {user_width} bytes cannot be stored in the report file")
+
+    records = np.zeros(len(users), dtype=report_dtype(privacy_method, m, user_width))
+    if privacy_method == "PCMeS":
+        records["v"] = reports.bits
+        records["j"] = reports.j
+    else:
+        records["w"] = [r[0] for r in reports]
+        records["j"] = [r[1] for r in reports]
+        records["l"] = [r[2] for r in reports]
+    records["user"] = users
+    return records
+
+def records_to_reports(records, privacy_method, m):
+    """
+    Converts report records back into the reports consumed by the aggregation.
+
+    Returns:
+        ReportBatch or pandas.DataFrame: A ReportBatch viewing the packed vectors for PCMeS,
+        or a DataFrame with the (w, j, l, user) columns for PHCMS.
+    """
+    import pandas as pd
+    from clip_protocol.count_mean.report_batch import ReportBatch
+    users = np.char.decode(records["user"], "utf-8").astype(object)
+    if privacy_method == "PCMeS":
+        return ReportBatch(records["v"], records["j"].astype(np.int64), users, m)
+    return pd.DataFrame({"0": records["w"].astype(np.float64), "1": records["j"].astype(np.int64),
+                         "2": records["l"].astype(np.int64), "3": users})
+
+def read_report_header(path):
+    """
+    Reads the header of a report file.
+
+    Returns:
+        tuple: The header metadata, the record type and the offset of the first record.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(REPORT_FILE_MAGIC)) != REPORT_FILE_MAGIC:
+            raise ValueError(f"{path} is not a report file")
+        size = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        header = json.loads(f.read(size).decode("utf-8"))
+    offset = -(-(len(REPORT_FILE_MAGIC) + 4 + size) // REPORT_FILE_ALIGN) * REPORT_FILE_ALIGN
+    return header, report_dtype(header["privacy_method"], header["m"], header["user_width"]), offset
+
+def write_report_file(path, reports, metadata, append=False, user_width=None):
+    """
+    Writes privatized reports to a binary report file.
+
+    The file starts with a header holding the privacy method, k, m, e and the
+    hash parameters, followed by fixed-size records (see report_dtype). In
+    append mode the records are added at the end of an existing file, whose
+    header must match the given metadata.
+
+    Args:
+        path (str): Path of the report file.
+        reports (ReportBatch or list): Reports to write.
+        metadata (dict): Mask parameters with "privacy_method", "k", "m", "e" and "hash".
+        append (bool): Whether to add the reports to an existing file.
+        user_width (int, optional): Bytes reserved per user when the file is created.
+            By default the longest user of the reports, at least 16.
+    """
+    metadata = json.loads(json.dumps(metadata))
+    if append and os.path.exists(path):
+        header, _, _ = read_report_header(path)
+        mismatches = [key for key, value in metadata.items() if header.get(key) != value]
+        if mismatches:
+            raise ValueError(f"Reports cannot be appended to {path}, different {', '.join(mismatches)}")
+        records = reports_to_records(reports, metadata["privacy_method"], metadata["m"], header["user_width"])
+        with open(path, "ab") as f:
+            f.write(records.tobytes())
+        return
+
+    if user_width is None:
+        users = reports.users if hasattr(reports, "users") else [r[-1] for r in reports]
+        user_width = max([16] + [len(str(u).encode("utf-8")) for u in users])
+    records = reports_to_records(reports, metadata["privacy_method"], metadata["m"], user_width)
+    header = json.dumps({**metadata, "user_width": user_width}).encode("utf-8")
+    prefix = REPORT_FILE_MAGIC + np.array([len(header)], dtype="<u4").tobytes() + header
+    padding = -len(prefix) % REPORT_FILE_ALIGN
+    with open(path, "wb") as f:
+        f.write(prefix + b" " * padding)
+        f.write(records.tobytes())
+
+def open_report_file(path):
+    """
+    Opens a report file as a read-only memory map.
+
+    Returns:
+        tuple: The header metadata and the memory-mapped records.
+    """
+    header, dtype, offset = read_report_header(path)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+def save_mask_json(mask_instance, e, coeffs, privatized_dataset, privacy_method, append=False):
     config = {
         "k": mask_instance.k,
         "m": mask_instance.m,
@@ -46,77 +197,316 @@ def save_mask_json(mask_instance, e, coeffs, privatized_dataset, privacy_method)
         "hash": coeffs,
         "privacy_method": str(mask_instance.privacy_method),
     }
-    converted_data = []
-    if privacy_method == "PCMeS":
-        for v, j, u in privatized_dataset:
-            v_str = " ".join(map(str, v.tolist()))
-            converted_data.append([v_str, j, u])
-    elif privacy_method == "PHCMS":
-        for w, j, l, u in privatized_dataset:
-            converted_data.append([w, j, l, u])
-
-    df = pd.DataFrame(converted_data)
-    df.to_csv(PRIVATIZED_DATASET, index=False)
+    metadata = {"privacy_method": privacy_method, "k": config["k"], "m": config["m"], "e": e, "hash": coeffs}
+    ensure_data_dir()
+    write_report_file(PRIVATIZED_DATASET, privatized_dataset, metadata, append=append)
 
     with open(CONFIG_MASK, "w") as f:
         json.dump(config, f)
         print("✅ Mask configuration saved")
 
-def load_mask_json():
+def load_mask_json(with_dataset=True):
     with open(CONFIG_MASK, "r") as f:
         config = json.load(f)
     
     hash_params = config["hash"]
     hash_functions = rebuild_hash_functions(hash_params)
 
-    df = pd.read_csv(PRIVATIZED_DATASET)
+    df = None
+    if with_dataset:
+        _, records = open_report_file(PRIVATIZED_DATASET)
+        df = records_to_reports(records, config["privacy_method"], config["m"])
 
     return config["k"], config["m"], config["e"], hash_functions, config["privacy_method"], df
 
-def save_agregate_json(agregate_instance):
-    with open(CONFIG_AGREGATE, "wb") as f:
-        pickle.dump(agregate_instance.sketch_by_user, f)
+def read_privatized_dataset(chunk_size, skip=0):
+    """
+    Reads the privatized dataset saved by the mask step in chunks.
+
+    The report file is memory-mapped, so only the chunk being converted is
+    read from disk.
+
+    Args:
+        chunk_size (int): Number of reports of every chunk.
+        skip (int): Number of reports skipped from the beginning.
+
+    Returns:
+        Iterator over the reports of every chunk, as returned by records_to_reports.
+    """
+    header, records = open_report_file(PRIVATIZED_DATASET)
+    for start in range(skip, len(records), chunk_size):
+        yield records_to_reports(records[start:start + chunk_size], header["privacy_method"], header["m"])
+
+def save_agregate_checkpoint(sums_by_user, rows, metadata):
+    """
+    Saves the partial sums of the user sketches of a streamed aggregation.
+
+    The checkpoint is written to a temporary file and then renamed, so an
+    interruption never leaves a half-written checkpoint behind.
+
+    Args:
+        sums_by_user (dict): Maps each user to the SketchAccumulator with their sums.
+        rows (int): Number of reports already added to the sums.
+        metadata (dict): Mask parameters the sketches are built with.
+    """
+    users = list(sums_by_user)
+    arrays = {f"S_{i}": sums_by_user[user].S for i, user in enumerate(users)}
+    counts = [sums_by_user[user].counts.tolist() for user in users]
+    index = {"users": users, "counts": counts, "rows": rows, **metadata}
+    ensure_data_dir()
+    tmp_path = AGREGATE_CHECKPOINT + ".tmp.npz"
+    np.savez(tmp_path, index=np.array(json.dumps(index)), **arrays)
+    os.replace(tmp_path, AGREGATE_CHECKPOINT)
+
+def load_agregate_checkpoint(metadata):
+    """
+    Loads the checkpoint of an interrupted streamed aggregation.
+
+    Args:
+        metadata (dict): Mask parameters of the current aggregation.
+
+    Returns:
+        tuple: The SketchAccumulator of every user and the number of reports already added.
+               Without a checkpoint of the same mask, no sums and 0 reports.
+    """
+    if not os.path.exists(AGREGATE_CHECKPOINT):
+        return {}, 0
+    with np.load(AGREGATE_CHECKPOINT) as checkpoint:
+        index = json.loads(str(checkpoint["index"]))
+        # Checkpoints of other masks, or saved before the sums were kept, are not resumed
+        if any(index.get(key) != value for key, value in metadata.items()) or "counts" not in index:
+            return {}, 0
+        sums_by_user = {}
+        for i, (user, counts) in enumerate(zip(index["users"], index["counts"])):
+            S = checkpoint[f"S_{i}"]
+            sums = SketchAccumulator(index["k"], index["m"], index["privacy_method"], S.dtype)
+            sums.S[:] = S
+            sums.counts[:] = counts
+            sums_by_user[user] = sums
+    return sums_by_user, index["rows"]
+
+def clear_agregate_checkpoint():
+    if os.path.exists(AGREGATE_CHECKPOINT):
+        os.remove(AGREGATE_CHECKPOINT)
+
+def save_sketch_store(path, sketch_by_user, metadata):
+    """
+    Saves the user sketches as a binary sketch store.
+
+    The store is made of two files: `<path>.npy` with a contiguous
+    (users, k, m) array holding every sketch, and `<path>.json` with the
+    user index, the number of reports per user and the given metadata.
+
+    Args:
+        path (str): Path of the store without extension.
+        sketch_by_user (dict): Maps each user to a dict with the sketch "M" and "N".
+        metadata (dict): Parameters saved with the sketches (k, m, e, privacy_method...).
+            The sketches are stored with its "dtype", float64 by default.
+    """
+    users = list(sketch_by_user)
+    shape = (len(users),) + np.shape(sketch_by_user[users[0]]["M"]) if users else (0, 0, 0)
+    dtype = metadata.get("dtype", "float64")
+    sketches = np.lib.format.open_memmap(path + ".npy", mode="w+", dtype=dtype, shape=shape)
+    for i, user in enumerate(users):
+        sketches[i] = sketch_by_user[user]["M"]
+    sketches.flush()
+    del sketches
+
+    index = {
+        "users": [user.item() if hasattr(user, "item") else user for user in users],
+        "N": [int(sketch_by_user[user]["N"]) for user in users],
+        **metadata,
+    }
+    with open(path + ".json", "w") as f:
+        json.dump(index, f)
+
+def load_sketch_store(path, mmap_mode="r"):
+    """
+    Opens a binary sketch store written by save_sketch_store.
+
+    Args:
+        path (str): Path of the store without extension.
+        mmap_mode (str): Memory-map mode of the sketches, None loads them in memory.
+
+    Returns:
+        tuple: The list of users, the (users, k, m) sketches, the number of reports per user and the metadata.
+    """
+    with open(path + ".json", "r") as f:
+        index = json.load(f)
+    sketches = np.load(path + ".npy", mmap_mode=mmap_mode)
+    users = index.pop("users")
+    N = np.array(index.pop("N"), dtype=np.int64)
+    return users, sketches, N, index
+
+def save_agregate_json(agregate_instance, path=CONFIG_AGREGATE):
+    metadata = {
+        "k": agregate_instance.k,
+        "m": agregate_instance.m,
+        "e": agregate_instance.e,
+        "privacy_method": agregate_instance.privacy_method,
+        "hash": agregate_instance.hashes.params(),
+        "dtype": agregate_instance.dtype,
+    }
+    if path == CONFIG_AGREGATE:
+        ensure_data_dir()
+    save_sketch_store(path, agregate_instance.sketch_by_user, metadata)
     print("✅ Agregate configuration saved")
 
-def load_agregate_json():
-    with open(CONFIG_AGREGATE, "rb") as f:
-        sketch_by_user = pickle.load(f)
-    return sketch_by_user
+def load_agregate_json(path=CONFIG_AGREGATE):
+    return load_sketch_store(path)
 
 def deterministic_hash(x):
     return int(hashlib.sha256(str(x).encode('utf-8')).hexdigest(), 16)
 
+def is_prime(n):
+    """
+    Deterministic Miller-Rabin primality test.
+
+    The bases 2, 3, 5 and 7 give the exact answer for every n below
+    3,215,031,751, which covers the primes of the hash functions. Larger n
+    are tested with the first twelve primes as bases, exact below 3.3e24.
+    """
+    if n < 2:
+        return False
+    small_primes = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+    for q in small_primes:
+        if n % q == 0:
+            return n == q
+    bases = small_primes[:4] if n < 3215031751 else small_primes
+
+    # n - 1 = d * 2^r with d odd
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def random_prime(low=10**6, high=10**7):
+    """
+    Draws a prime uniformly at random from [low, high).
+
+    Integers of the range are drawn until one is prime, so every prime of the
+    range is equally likely, as when picking from the list of all of them,
+    after about ln(high) draws on average.
+    """
+    while True:
+        n = random.randrange(low, high)
+        if is_prime(n):
+            return n
+
+class HashFamily:
+    """
+    Family of k polynomial hash functions over the finite field of order p.
+
+    The SHA-256 digest of every element is reduced modulo p once and kept in a
+    bounded LRU cache, so evaluating the k hash functions of an element only
+    costs a handful of integer operations.
+
+    Attributes:
+        coefficients (numpy.ndarray): (k, c) matrix with the polynomial coefficients.
+        p (int): Prime defining the finite field.
+        m (int): Output range of the hash functions.
+        c (int): Number of coefficients of each polynomial.
+        cache_size (int): Maximum number of digests kept in the cache.
+    """
+    def __init__(self, coefficients, p, m, c, cache_size=2**16):
+        self.coefficients = np.asarray(coefficients, dtype=np.int64).reshape(-1, c)
+        self.p = p
+        self.m = m
+        self.c = c
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.coefficients)
+
+    def __getitem__(self, i):
+        return partial(self.hash_row, i)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        return state
+
+    def digest(self, x):
+        """Returns the SHA-256 digest of x reduced modulo p, using the cache."""
+        # The digest hashes str(x), so the cache is keyed by it too: 1, 1.0 and True
+        # compare equal but have different digests
+        key = str(x)
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            residue = deterministic_hash(key) % self.p
+            self._cache[key] = residue
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return residue
+
+    def hash_all(self, elements):
+        """
+        Evaluates the k hash functions over a collection of elements.
+
+        Args:
+            elements (iterable): Elements to hash.
+
+        Returns:
+            numpy.ndarray: (k, n) int64 matrix where entry [i, t] is H_i(elements[t]).
+        """
+        x = np.fromiter((self.digest(d) for d in elements), dtype=np.int64)
+        acc = np.zeros((len(self), len(x)), dtype=np.int64)
+        power = np.ones_like(x)
+        for i in range(self.c):
+            acc += (self.coefficients[:, i:i + 1] * power) % self.p
+            power = (power * x) % self.p
+        return (acc % self.p) % self.m
+
+    def hash_element(self, d):
+        """Returns the k hash values of a single element as an int64 vector."""
+        return self.hash_all([d])[:, 0]
+
+    def hash_row(self, i, d):
+        """Evaluates the i-th hash function over the element d."""
+        x = self.digest(d)
+        coeffs = self.coefficients[i]
+        return (sum((int(coeffs[t]) * pow(x, t, self.p)) % self.p for t in range(self.c)) % self.p) % self.m
+
+    def params(self):
+        """Returns the serializable parameters of the family."""
+        return {
+            "coefficients": self.coefficients.tolist(),
+            "p": self.p,
+            "m": self.m,
+            "c": self.c
+        }
+
 def generate_hash_functions(k, p, c, m):
-    hash_functions = []
-    coeffs = []
-    functions_params = {}
-
-    for _ in range(k):
-        coefficients = [random.randint(1, p - 1) for _ in range(c)]
-        hash_func = lambda x, coeffs=coefficients, p=p: (sum((coeffs[i] * (deterministic_hash(x) ** i)) % p for i in range(c)) % p) % m
-        hash_functions.append(hash_func)
-        coeffs.append(coefficients)
-    
-    functions_params = {
-        "coefficients": coeffs,
-        "p": p,
-        "m": m,
-        "c": c
-    }
-    return hash_functions, functions_params
+    coeffs = [[random.randint(1, p - 1) for _ in range(c)] for _ in range(k)]
+    hash_functions = HashFamily(coeffs, p, m, c)
+    return hash_functions, hash_functions.params()
 
 def rebuild_hash_functions(functions_params):
-    hash_functions = []
-    hash_coeffs = functions_params["coefficients"]
-    p = functions_params["p"]
-    m = functions_params["m"]
-    c = functions_params["c"]
-    for coeffs in hash_coeffs:
-        hash_func = lambda x, coeffs=coeffs, p=p: (sum((coeffs[i] * (deterministic_hash(x) ** i)) % p for i in range(c)) % p) % m
-        hash_functions.append(hash_func)
-    return hash_functions
-
-def display_results(real_freq: pd.DataFrame, estimated_freq: dict):
+    return HashFamily(
+        functions_params["coefficients"],
+        functions_params["p"],
+        functions_params["m"],
+        functions_params["c"]
+    )
+
+def display_results(real_freq: "pd.DataFrame", estimated_freq: dict):
     real_num_freq = dict(zip(real_freq['Element'], real_freq['Frequency']))
 
     N = sum(real_num_freq.values())
@@ -149,7 +539,61 @@ def display_results(real_freq: pd.DataFrame, estimated_freq: dict):
             ])
     return data_table
 
+def encode_events(df):
+    """
+    Cleans the event values of a dataset and dictionary-encodes them.
+
+    The values are stripped and the ones equal to "-" or without any word
+    character are dropped. The string work is done once per distinct value,
+    and every row only keeps an integer code into the dictionary of events.
+
+    Args:
+        df (pandas.DataFrame): Dataset with the "user" and "value" columns.
+
+    Returns:
+        pandas.DataFrame: The rows with a valid event, with "value" as a pandas Categorical.
+    """
+    import pandas as pd
+    codes, uniques = pd.factorize(df["value"], use_na_sentinel=False)
+    events = pd.Index(uniques).astype(str).str.strip()
+    valid = np.asarray((events != "-") & events.str.contains(r"\w", na=False))
+
+    # Raw values that only differ in their surrounding spaces become the same event
+    valid_codes, categories = pd.factorize(events[valid])
+    event_code = np.full(len(events), -1, dtype=np.int64)
+    event_code[valid] = valid_codes
+    row_codes = event_code[codes]
+
+    keep = row_codes >= 0
+    df = df[keep].copy()
+    df["value"] = pd.Categorical.from_codes(row_codes[keep], categories)
+    return df
+
+def event_codes(values):
+    """
+    Returns the events of a column as integer codes into the list of distinct events.
+
+    Categorical columns are read from their codes without touching the
+    values; any other column is factorized, with missing values as one more
+    event so every row has a valid code.
+
+    Args:
+        values (pandas.Series): Event values.
+
+    Returns:
+        tuple: The int64 code of every row and the list of distinct events it indexes.
+    """
+    import pandas as pd
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        return values.cat.codes.to_numpy(dtype=np.int64), values.cat.categories.tolist()
+    codes, elements = pd.factorize(values, use_na_sentinel=False)
+    return codes.astype(np.int64, copy=False), list(elements)
+
 def get_real_frequency(df):
-    count = df['value'].value_counts().reset_index()
-    count.columns = ['Element', 'Frequency']
-    return count
\ No newline at end of file
+    import pandas as pd
+    codes, elements = event_codes(df['value'])
+    counts = np.bincount(codes, minlength=len(elements))
+    # Most frequent first, like value_counts
+    order = np.argsort(-counts, kind="stable")
+    return pd.DataFrame({'Element': [elements[i] for i in order], 'Frequency': counts[order]})
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import pytest
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Points the files saved by the pipeline steps to a temporary data folder."""
+    from clip_protocol.utils import utils
+    monkeypatch.setattr(utils, "DATA_DIR", str(tmp_path))
+    for name in ("CONFIG_FILE", "CONFIG_MASK", "CONFIG_AGREGATE", "PRIVATIZED_DATASET", "AGREGATE_CHECKPOINT"):
+        monkeypatch.setattr(utils, name, os.path.join(str(tmp_path), os.path.basename(getattr(utils, name))))
+    return tmp_path
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.main import agregate
+from clip_protocol.main.agregate import Agregate
+from clip_protocol.utils import utils
+from clip_protocol.utils.sketch import SketchAccumulator
+
+K, M, E = 8, 32, 3.0
+CHUNK = 100
+
+
+class MaskRun:
+    k, m, privacy_method = K, M, "PCMeS"
+
+@pytest.fixture
+def mask_saved(data_dir):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"user": rng.choice(["ana", "bob", "eva"], size=1000),
+                       "value": rng.choice(["AOI 1", "AOI 2", "AOI 3"], size=1000)})
+    client = privateCMSClient(E, K, M, df)
+    utils.save_mask_json(MaskRun(), E, client.H.params(), client.execute_client(), "PCMeS")
+    return data_dir
+
+def checkpoint_metadata(instance):
+    """Mask parameters saved with the checkpoints of agregate_stream."""
+    return {"k": instance.k, "m": instance.m, "e": instance.e, "privacy_method": instance.privacy_method,
+            "hash": instance.hashes.params(), "dtype": instance.dtype}
+
+def stream(**kwargs):
+    instance = Agregate(stream=True)
+    instance.agregate_stream(chunk_size=CHUNK, **kwargs)
+    return instance.sketch_by_user
+
+def assert_same_sketches(sketches, expected):
+    assert list(sketches) == list(expected)
+    for user in expected:
+        assert sketches[user]["N"] == expected[user]["N"]
+        np.testing.assert_array_equal(sketches[user]["M"], expected[user]["M"])
+
+def test_stream_resumes_from_the_checkpoint(mask_saved, monkeypatch):
+    expected = stream()
+
+    read = agregate.read_privatized_dataset
+    def interrupted(chunk_size, skip=0):
+        for i, chunk in enumerate(read(chunk_size, skip)):
+            if i == 4:
+                raise KeyboardInterrupt
+            yield chunk
+    monkeypatch.setattr(agregate, "read_privatized_dataset", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        stream(checkpoint_every=3)
+    _, rows = utils.load_agregate_checkpoint(checkpoint_metadata(Agregate(stream=True)))
+    assert rows == 3 * CHUNK
+
+    monkeypatch.setattr(agregate, "read_privatized_dataset", read)
+    assert_same_sketches(stream(checkpoint_every=3), expected)
+    assert not (mask_saved / "agregate_checkpoint.npz").exists()
+
+def test_checkpoint_of_other_parameters_is_ignored(mask_saved):
+    expected = stream()
+
+    instance = Agregate(stream=True)
+    metadata = {**checkpoint_metadata(instance), "e": E + 1}
+    sums = SketchAccumulator(K, M, "PCMeS")
+    sums.S += 1000
+    sums.counts += 1000
+    utils.save_agregate_checkpoint({"ana": sums}, 500, metadata)
+    assert utils.load_agregate_checkpoint(checkpoint_metadata(instance)) == ({}, 0)
+
+    assert_same_sketches(stream(), expected)
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.hadamard_count_mean.private_hcms_client import privateHCMSClient
+
+HASH = {"coefficients": [[3, 5, 7], [11, 13, 17], [19, 23, 29], [31, 37, 41]], "p": 1000003, "m": 32, "c": 3}
+
+
+@pytest.mark.parametrize("client_class", [privateCMSClient, privateHCMSClient])
+def test_seeded_clients_reproduce_their_run(client_class):
+    df = pd.DataFrame({"user": "ana", "value": ["AOI 1", "AOI 2", "AOI 3"] * 100})
+    runs = []
+    for _ in range(2):
+        client = client_class(2.0, 4, 32, df, hash_params=HASH)
+        client.rng = np.random.default_rng(7)
+        reports = client.execute_client()
+        np.random.seed(None)
+        estimated, _ = client.simulate_server()
+        runs.append((list(reports), estimated["Frequency"].to_numpy()))
+    (first, first_estimates), (second, second_estimates) = runs
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a[0], b[0])
+        assert a[1:] == b[1:]
+    np.testing.assert_array_equal(first_estimates, second_estimates)
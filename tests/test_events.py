@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.utils.utils import encode_events, event_codes, get_real_frequency
+
+
+def test_encode_events_strips_and_drops_invalid_values():
+    df = pd.DataFrame({"user": list("abcdef"), "value": [" AOI 1", "AOI 1", "-", " ", "AOI 2 ", "!!"]})
+    encoded = encode_events(df)
+    assert encoded["user"].tolist() == ["a", "b", "e"]
+    assert encoded["value"].astype(str).tolist() == ["AOI 1", "AOI 1", "AOI 2"]
+    assert isinstance(encoded["value"].dtype, pd.CategoricalDtype)
+
+def test_event_codes_keep_missing_values_as_an_event():
+    values = pd.Series(["a", np.nan, "b", "a", np.nan])
+    codes, elements = event_codes(values)
+    assert codes.min() >= 0
+    assert [elements[c] if isinstance(elements[c], str) else "missing" for c in codes] == ["a", "missing", "b", "a", "missing"]
+
+def test_clients_accept_missing_values():
+    df = pd.DataFrame({"user": "u", "value": ["a", "b", np.nan, "a"] * 50})
+    client = privateCMSClient(3.0, 8, 32, df)
+    estimated, _ = client.simulate_server()
+    assert len(estimated) == 3
+    real = get_real_frequency(df)
+    assert real["Frequency"].tolist() == [100, 50, 50]
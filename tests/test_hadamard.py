@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from clip_protocol.hadamard_count_mean.private_hcms_client import hadamard_entry, hadamard_matrix, traspose_M
+
+
+@pytest.mark.parametrize("m", [1, 2, 8, 64, 256])
+@pytest.mark.parametrize("dtype", [np.float64, np.int32, np.int64])
+def test_fast_transform_matches_the_dense_product(m, dtype):
+    rng = np.random.default_rng(m)
+    M = rng.integers(-50, 50, size=(5, m)).astype(dtype)
+    H = hadamard_matrix(m)
+    transformed = traspose_M(M)
+    assert transformed.dtype == dtype
+    np.testing.assert_array_equal(transformed, M @ H.T)
+
+def test_transform_leaves_the_input_untouched():
+    M = np.arange(16, dtype=np.float64).reshape(2, 8)
+    traspose_M(M)
+    np.testing.assert_array_equal(M, np.arange(16).reshape(2, 8))
+
+def test_hadamard_entry_matches_the_matrix():
+    H = hadamard_matrix(32)
+    l, h = np.meshgrid(np.arange(32), np.arange(32), indexing="ij")
+    np.testing.assert_array_equal(hadamard_entry(l, h), H)
+
+def test_transform_rejects_sizes_that_are_not_powers_of_2():
+    with pytest.raises(ValueError, match="power of 2"):
+        traspose_M(np.zeros((2, 12)))
@@ -0,0 +1,32 @@
+import numpy as np
+
+from clip_protocol.utils.utils import HashFamily, deterministic_hash, rebuild_hash_functions
+
+COEFFICIENTS = [[17, 4, 999983], [2, 654321, 3], [123456, 1, 77]]
+P, M, C = 1000003, 97, 3
+ELEMENTS = ["AOI 1", "AOI 2", "Parque", "", 42, 3.5, None]
+
+
+def polynomial_hash(coeffs, x):
+    """Hash function as originally defined, over the full SHA-256 integer of the element."""
+    return (sum((coeffs[i] * (deterministic_hash(x) ** i)) % P for i in range(C)) % P) % M
+
+def test_hash_family_matches_the_original_polynomial():
+    family = HashFamily(COEFFICIENTS, P, M, C)
+    expected = np.array([[polynomial_hash(coeffs, x) for x in ELEMENTS] for coeffs in COEFFICIENTS])
+    np.testing.assert_array_equal(family.hash_all(ELEMENTS), expected)
+    for i, coeffs in enumerate(COEFFICIENTS):
+        assert [family[i](x) for x in ELEMENTS] == expected[i].tolist()
+    np.testing.assert_array_equal(family.hash_element("AOI 2"), expected[:, 1])
+
+def test_rebuilt_family_hashes_like_the_saved_one():
+    family = HashFamily(COEFFICIENTS, P, M, C)
+    rebuilt = rebuild_hash_functions(family.params())
+    np.testing.assert_array_equal(rebuilt.hash_all(ELEMENTS), family.hash_all(ELEMENTS))
+
+def test_equal_elements_with_different_text_keep_their_own_hash():
+    family = HashFamily(COEFFICIENTS, P, M, C)
+    family.hash_all([1])
+    elements = [1, 1.0, True]
+    expected = np.array([[polynomial_hash(coeffs, x) for x in elements] for coeffs in COEFFICIENTS])
+    np.testing.assert_array_equal(family.hash_all(elements), expected)
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.main import estimate
+from clip_protocol.main.agregate import build_user_sketch
+from clip_protocol.main.estimate import Estimation
+from clip_protocol.main.merge import run_merge
+from clip_protocol.utils.utils import load_sketch_store, save_sketch_store
+
+K, M, E = 16, 64, 4.0
+
+
+@pytest.fixture(scope="module")
+def privatized():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "user": rng.choice(["ana", "bob", "eva"], size=3000),
+        "value": rng.choice(["AOI 1", "AOI 2", "AOI 3"], size=3000, p=[0.6, 0.3, 0.1]),
+    })
+    client = privateCMSClient(E, K, M, df)
+    return df, client.execute_client(), client.H.params()
+
+def save_site(path, reports, metadata):
+    """Aggregates the reports of one collection site into a sketch store."""
+    sketch_by_user = {}
+    for user, rows in reports.user_rows().items():
+        sketch_by_user[user] = {"M": build_user_sketch(reports.take(rows), K, M, E, "PCMeS"), "N": len(rows)}
+    save_sketch_store(path, sketch_by_user, metadata)
+
+def store_metadata(hash_params):
+    return {"k": K, "m": M, "e": E, "privacy_method": "PCMeS", "hash": hash_params, "dtype": "float64"}
+
+@pytest.fixture
+def no_mask_config(monkeypatch):
+    """Fails if the estimation reads the local mask configuration, as on a central machine."""
+    def load_mask_json(*args, **kwargs):
+        raise FileNotFoundError("mask_config.json")
+    monkeypatch.setattr(estimate, "load_mask_json", load_mask_json)
+
+def test_merge_then_estimate(tmp_path, privatized, no_mask_config):
+    df, reports, hash_params = privatized
+    metadata = store_metadata(hash_params)
+    half = len(reports) // 2
+    save_site(str(tmp_path / "site_a"), reports.take(np.arange(half)), metadata)
+    save_site(str(tmp_path / "site_b"), reports.take(np.arange(half, len(reports))), metadata)
+    save_site(str(tmp_path / "all"), reports, metadata)
+
+    run_merge([str(tmp_path / "site_a"), str(tmp_path / "site_b")], str(tmp_path / "merged"))
+
+    merged = Estimation(load_sketch_store(str(tmp_path / "merged")))
+    single = Estimation(load_sketch_store(str(tmp_path / "all")))
+    events = ["AOI 1", "AOI 2", "AOI 3"]
+    assert merged.users == single.users
+    np.testing.assert_array_equal(merged.N, single.N)
+    np.testing.assert_allclose(merged.estimate_matrix(events), single.estimate_matrix(events))
+
+    # The estimates follow the real frequencies of every user
+    estimates = merged.estimate_events(events)
+    real = df.groupby(["user", "value"]).size().unstack()
+    for user in merged.users:
+        assert estimates.loc[user].idxmax() == real.loc[user].idxmax()
+
+@pytest.mark.parametrize("name, value", [("k", K + 1), ("m", M * 2), ("e", E + 1), ("hash", None)])
+def test_incompatible_merge_is_rejected(tmp_path, privatized, name, value):
+    _, reports, hash_params = privatized
+    metadata = store_metadata(hash_params)
+    other = dict(metadata)
+    if name == "hash":
+        coefficients = np.array(hash_params["coefficients"])
+        coefficients[0, 0] += 1
+        value = {**hash_params, "coefficients": coefficients.tolist()}
+    other[name] = value
+    save_site(str(tmp_path / "site_a"), reports, metadata)
+    save_site(str(tmp_path / "site_b"), reports, other)
+
+    with pytest.raises(ValueError, match="cannot be merged"):
+        run_merge([str(tmp_path / "site_a"), str(tmp_path / "site_b")], str(tmp_path / "merged"))
+    assert not (tmp_path / "merged.npy").exists()
+
+def test_server_merge_matches_a_single_server():
+    from clip_protocol.hadamard_count_mean.private_hcms_client import privateHCMSClient
+    from clip_protocol.hadamard_count_mean.private_hcms_server import privateHCMSServer
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"user": "ana", "value": rng.choice(["AOI 1", "AOI 2", "AOI 3"], size=2000)})
+    client = privateHCMSClient(E, K, M, df)
+    reports = client.execute_client()
+    whole = privateHCMSServer(E, K, M, df, client.hashes)
+    whole.execute_server(reports)
+    first = privateHCMSServer(E, K, M, df[:1200], client.hashes)
+    first.execute_server(reports[:1200])
+    second = privateHCMSServer(E, K, M, df[1200:], client.hashes)
+    # The reports read back from the report file are a DataFrame
+    second.execute_server(pd.DataFrame(reports[1200:], columns=["0", "1", "2", "3"]))
+    first.merge(second)
+    assert first.N == whole.N
+    np.testing.assert_allclose(first.M, whole.M)
+
+    other = privateHCMSServer(E + 1, K, M, df, client.hashes)
+    with pytest.raises(ValueError, match="cannot be merged, different e"):
+        first.merge(other)
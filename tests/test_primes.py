@@ -0,0 +1,40 @@
+import random
+
+import numpy as np
+import pytest
+
+from clip_protocol.utils.utils import is_prime, random_prime
+
+CARMICHAEL = [561, 1105, 1729, 2465, 2821, 6601, 8911, 41041, 825265, 321197185]
+# Strong pseudoprimes: to the bases 2, 3, 5 and 7, and to every prime base up to 23
+STRONG_PSEUDOPRIMES = [3215031751, 3825123056546413051]
+LARGE_PRIMES = [1000003, 2147483647, 2305843009213693951, 18446744073709551557]
+
+
+def sieve(n):
+    flags = np.ones(n, dtype=bool)
+    flags[:2] = False
+    for q in range(2, int(n ** 0.5) + 1):
+        if flags[q]:
+            flags[q * q::q] = False
+    return flags
+
+def test_is_prime_matches_a_sieve():
+    flags = sieve(20000)
+    assert [n for n in range(-5, 20000) if is_prime(n)] == np.flatnonzero(flags).tolist()
+
+@pytest.mark.parametrize("n", CARMICHAEL + STRONG_PSEUDOPRIMES)
+def test_is_prime_rejects_pseudoprimes(n):
+    assert not is_prime(n)
+
+@pytest.mark.parametrize("n", LARGE_PRIMES)
+def test_is_prime_accepts_large_primes(n):
+    assert is_prime(n)
+    assert not is_prime(n * 3)
+
+def test_random_prime_is_a_prime_in_range():
+    random.seed(0)
+    for low, high in [(10**6, 10**7), (100, 110), (2, 3)]:
+        p = random_prime(low, high)
+        assert low <= p < high
+        assert all(p % q for q in range(2, int(p ** 0.5) + 1))
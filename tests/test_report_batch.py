@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from clip_protocol.count_mean.report_batch import ReportBatch
+
+M = 13
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.choice(np.array([-1, 1], dtype=np.int8), size=(40, M))
+
+def test_pack_unpack_round_trip(vectors):
+    batch = ReportBatch.from_vectors(vectors, np.arange(40) % 3, [f"u{i % 4}" for i in range(40)])
+    assert batch.bits.shape == (40, 2)
+    np.testing.assert_array_equal(batch.vectors(), vectors)
+    np.testing.assert_array_equal(batch.vectors(5, 9), vectors[5:9])
+    for i, (v, j, user) in enumerate(batch):
+        np.testing.assert_array_equal(v, vectors[i])
+        assert (j, user) == (i % 3, f"u{i % 4}")
+
+def test_set_fills_an_empty_batch(vectors):
+    batch = ReportBatch.empty(40, M)
+    batch.set(0, vectors[:25], np.zeros(25), ["a"] * 25)
+    batch.set(25, vectors[25:], np.ones(15), ["b"] * 15)
+    np.testing.assert_array_equal(batch.vectors(), vectors)
+    assert {user: rows.tolist() for user, rows in batch.user_rows().items()} == {"a": list(range(25)),
+                                                                                  "b": list(range(25, 40))}
+
+def test_getitem_counts_negative_positions_from_the_end(vectors):
+    batch = ReportBatch.from_vectors(vectors, np.arange(40), ["u"] * 40)
+    v, j, user = batch[-1]
+    np.testing.assert_array_equal(v, vectors[-1])
+    assert (j, user) == (39, "u")
+    assert batch[-40][1] == 0
+    for i in (40, -41):
+        with pytest.raises(IndexError):
+            batch[i]
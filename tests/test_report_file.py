@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clip_protocol.count_mean.report_batch import ReportBatch
+from clip_protocol.utils.utils import open_report_file, records_to_reports, write_report_file
+
+K, M, E = 4, 20, 2.0
+HASH = {"coefficients": [[1, 2], [3, 4], [5, 6], [7, 8]], "p": 101, "m": M, "c": 2}
+
+
+def metadata(privacy_method, **changes):
+    return {"privacy_method": privacy_method, "k": K, "m": M, "e": E, "hash": HASH, **changes}
+
+def pcmes_reports(n, seed):
+    rng = np.random.default_rng(seed)
+    V = rng.choice(np.array([-1, 1], dtype=np.int8), size=(n, M))
+    return ReportBatch.from_vectors(V, rng.integers(0, K, size=n), rng.choice(["ana", "bob"], size=n))
+
+def phcms_reports(n, seed):
+    rng = np.random.default_rng(seed)
+    return [(int(w), int(j), int(l), u) for w, j, l, u in zip(rng.choice([-1, 1], size=n), rng.integers(0, K, size=n),
+                                                             rng.integers(0, M, size=n), rng.choice(["ana", "bob"], size=n))]
+
+def test_pcmes_round_trip_with_append(tmp_path):
+    path = tmp_path / "reports.bin"
+    first, second = pcmes_reports(50, 0), pcmes_reports(30, 1)
+    write_report_file(path, first, metadata("PCMeS"))
+    write_report_file(path, second, metadata("PCMeS"), append=True)
+
+    header, records = open_report_file(path)
+    assert header == {**metadata("PCMeS"), "user_width": 16}
+    reports = records_to_reports(records, "PCMeS", M)
+    assert isinstance(reports, ReportBatch) and len(reports) == 80
+    np.testing.assert_array_equal(reports.vectors(), np.vstack([first.vectors(), second.vectors()]))
+    np.testing.assert_array_equal(reports.j, np.concatenate([first.j, second.j]))
+    assert reports.users.tolist() == first.users.tolist() + second.users.tolist()
+
+def test_phcms_round_trip_with_append(tmp_path):
+    path = tmp_path / "reports.bin"
+    first, second = phcms_reports(50, 0), phcms_reports(30, 1)
+    write_report_file(path, first, metadata("PHCMS"))
+    write_report_file(path, second, metadata("PHCMS"), append=True)
+
+    header, records = open_report_file(path)
+    reports = records_to_reports(records, header["privacy_method"], header["m"])
+    expected = pd.DataFrame(first + second, columns=["0", "1", "2", "3"]).astype({"0": np.float64})
+    pd.testing.assert_frame_equal(reports, expected, check_dtype=False)
+
+@pytest.mark.parametrize("changes", [{"k": K + 1}, {"m": M + 1}, {"e": E + 1},
+                                     {"hash": {**HASH, "coefficients": [[1, 2]] * K}}])
+def test_append_with_other_parameters_is_rejected(tmp_path, changes):
+    path = tmp_path / "reports.bin"
+    write_report_file(path, pcmes_reports(10, 0), metadata("PCMeS"))
+    size = path.stat().st_size
+    with pytest.raises(ValueError, match="cannot be appended"):
+        write_report_file(path, pcmes_reports(10, 1), metadata("PCMeS", **changes), append=True)
+    assert path.stat().st_size == size
+
+def test_long_users_are_rejected(tmp_path):
+    reports = [(1, 0, 0, "u" * 17)]
+    write_report_file(tmp_path / "reports.bin", reports, metadata("PHCMS"), user_width=17)
+    with pytest.raises(ValueError, match="longer than 17 bytes"):
+        write_report_file(tmp_path / "reports.bin", [(1, 0, 0, "u" * 18)], metadata("PHCMS"), append=True)
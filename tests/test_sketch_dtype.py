@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clip_protocol.count_mean.private_cms_client import privateCMSClient
+from clip_protocol.count_mean.private_cms_server import privateCMSServer
+from clip_protocol.hadamard_count_mean.private_hcms_client import privateHCMSClient
+from clip_protocol.hadamard_count_mean.private_hcms_server import privateHCMSServer
+from clip_protocol.main.agregate import Agregate
+from clip_protocol.main.estimate import Estimation
+from clip_protocol.utils import utils
+
+K, M, E = 16, 64, 2.0
+EVENTS = ["AOI 1", "AOI 2", "AOI 3", "AOI 4"]
+METHODS = ["PCMeS", "PHCMS"]
+
+
+@pytest.fixture(scope="module")
+def df():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"user": rng.choice(["ana", "bob"], size=4000),
+                         "value": rng.choice(EVENTS, size=4000, p=[0.4, 0.3, 0.2, 0.1])})
+
+def privatize(df, privacy_method):
+    """Privatizes the dataset once and returns the reports with the hash functions."""
+    if privacy_method == "PCMeS":
+        client = privateCMSClient(E, K, M, df)
+        return client.execute_client(), client.H
+    client = privateHCMSClient(E, K, M, df)
+    return client.execute_client(), client.hashes
+
+def assert_close_to_float64(estimates, N):
+    """Checks the estimates of every type against float64 with the differences stated in the README."""
+    tolerance = {"int32": 1e-9, "float32": 1e-8 * N}
+    for dtype, atol in tolerance.items():
+        np.testing.assert_allclose(estimates[dtype], estimates["float64"], rtol=0, atol=atol)
+
+class MaskRun:
+    k, m = K, M
+
+@pytest.mark.parametrize("privacy_method", METHODS)
+def test_agregate_dtypes_match_float64(data_dir, df, privacy_method):
+    reports, hashes = privatize(df, privacy_method)
+    mask = MaskRun()
+    mask.privacy_method = privacy_method
+    utils.save_mask_json(mask, E, hashes.params(), reports, privacy_method)
+
+    estimates = {}
+    for dtype in ("float64", "float32", "int32"):
+        instance = Agregate(dtype=dtype)
+        instance.agregate_per_user()
+        path = str(data_dir / f"sketches_{dtype}")
+        utils.save_agregate_json(instance, path)
+        estimation = Estimation(utils.load_sketch_store(path))
+        assert estimation.sketches.dtype == dtype
+        estimates[dtype] = estimation.estimate_matrix(EVENTS)
+    assert_close_to_float64(estimates, len(df))
+
+@pytest.mark.parametrize("privacy_method", METHODS)
+def test_server_dtypes_match_float64(df, privacy_method):
+    reports, hashes = privatize(df, privacy_method)
+    estimates = {}
+    for dtype in ("float64", "float32", "int32"):
+        server_class = privateCMSServer if privacy_method == "PCMeS" else privateHCMSServer
+        server = server_class(E, K, M, df, hashes, dtype)
+        estimates[dtype] = server.execute_server(reports).set_index("Element").loc[EVENTS, "Frequency"].to_numpy()
+        assert server.M.dtype == dtype
+    assert_close_to_float64(estimates, len(df))
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+from clip_protocol.utils.trials import TrialArtifacts
+
+
+def make_study(n):
+    return SimpleNamespace(trials=[SimpleNamespace(number=i) for i in range(n)])
+
+def test_lowest_matching_trial_wins_whatever_order_it_finished():
+    # Trials finish out of order in parallel: e=6 matches first, then e=4 also matches
+    study = make_study(3)
+    artifacts = TrialArtifacts()
+    artifacts.record(study.trials[1], 6, {"e": 6}, matching=True)
+    artifacts.record(study.trials[0], 9, {"e": 9})
+    artifacts.record(study.trials[2], 4, {"e": 4}, matching=True)
+
+    chosen = artifacts.chosen(study)
+    assert chosen.number == 2
+    assert artifacts.load(chosen) == {"e": 4}
+    assert set(artifacts.kept) == {2}
+
+def test_best_trial_without_a_matching_one():
+    study = make_study(3)
+    artifacts = TrialArtifacts()
+    for trial, value in zip(study.trials, (5, 3, 3)):
+        artifacts.record(trial, value, {"value": value})
+
+    # Ties keep the earliest trial
+    assert artifacts.chosen(study).number == 1
+    assert set(artifacts.kept) == {1}